@@ -0,0 +1,227 @@
+#! /usr/bin/python
+
+# Flat array representation of striped_ga strip trees
+
+# Copyright (c) 2007-2010 Matti Airas
+
+# Licensed under the PSF License
+
+"""
+Encode the strip trees of a whole population as flat arrays, so that
+the sizes of all the trees are computed at once without walking
+thousands of Strip and Item objects.
+
+The nodes of each tree are stored in breadth first order, which keeps
+the children of a node contiguous and after their parent. Per node the
+arrays hold the kind (item, horizontal or vertical strip), the parent,
+the first child and the number of children, the index of the item type
+and the rotation. The trees are concatenated; roots gives the index of
+each tree's root node.
+
+NumPy is required for the vectorized computation: with it the sizes
+are computed one tree level at a time for the whole population.
+Without it the arrays are array.array and the sizes are computed in a
+loop over the nodes, which gives the same sizes but no speedup over
+the Strip objects.
+"""
+
+import array
+from striped_ga import HStrip, VStrip, Item
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ITEM = 0
+HSTRIP = 1
+VSTRIP = 2
+
+_kinds = {HStrip: HSTRIP, VStrip: VSTRIP}
+_classes = {HSTRIP: HStrip, VSTRIP: VStrip}
+
+
+def _array(typecode,values):
+    if numpy is not None:
+        return numpy.array(values,dtype={'b': numpy.int8,
+                                         'l': numpy.int64,
+                                         'd': numpy.float64}[typecode])
+    return array.array(typecode,values)
+
+
+class FlatStrips(object):
+    """
+    The strip trees of a population as flat arrays.
+
+    strips   the root strips of the trees
+
+    The sizes are available after update_sizes() in the arrays w and h.
+    """
+
+    def __init__(self,strips):
+        self.types = []
+        type_index = {}
+        kind = []
+        parent = []
+        first = []
+        count = []
+        type_ = []
+        rotated = []
+        depth = []
+        self.ids = []
+        roots = []
+        for tree in strips:
+            nodes = [tree]
+            root = len(kind)
+            roots.append(root)
+            kind.append(_kinds[type(tree)])
+            parent.append(-1)
+            depth.append(0)
+            type_.append(-1)
+            rotated.append(0)
+            self.ids.append(None)
+            i = root
+            while i<len(kind):
+                node = nodes[i-root]
+                first.append(len(kind))
+                if kind[i]==ITEM:
+                    count.append(0)
+                else:
+                    count.append(len(node))
+                    for e in node:
+                        nodes.append(e)
+                        parent.append(i)
+                        depth.append(depth[i]+1)
+                        if isinstance(e,Item):
+                            key = id(e.type)
+                            if key not in type_index:
+                                type_index[key] = len(self.types)
+                                self.types.append(e.type)
+                            kind.append(ITEM)
+                            type_.append(type_index[key])
+                            rotated.append(int(e.rotated))
+                            self.ids.append(e.id)
+                        else:
+                            kind.append(_kinds[type(e)])
+                            type_.append(-1)
+                            rotated.append(0)
+                            self.ids.append(None)
+                i += 1
+        self.kind = _array('b',kind)
+        self.parent = _array('l',parent)
+        self.first = _array('l',first)
+        self.count = _array('l',count)
+        self.type = _array('l',type_)
+        self.rotated = _array('b',rotated)
+        self.depth = _array('l',depth)
+        self.roots = _array('l',roots)
+        self.type_w = _array('d',[t.w for t in self.types])
+        self.type_h = _array('d',[t.h for t in self.types])
+        self.w = None
+        self.h = None
+
+    def __len__(self):
+        return len(self.roots)
+
+    def update_sizes(self):
+        "Compute the sizes of all the nodes, like Strip.update_sizes."
+        if numpy is not None:
+            self._numpy_sizes()
+        else:
+            self._python_sizes()
+
+    def _numpy_sizes(self):
+        n = len(self.kind)
+        # one slot past the nodes ends the last child range
+        w = numpy.zeros(n+1)
+        h = numpy.zeros(n+1)
+        items = numpy.nonzero(self.kind==ITEM)[0]
+        t = self.type[items]
+        rot = self.rotated[items]==1
+        w[items] = numpy.where(rot,self.type_h[t],self.type_w[t])
+        h[items] = numpy.where(rot,self.type_w[t],self.type_h[t])
+        strips = (self.kind!=ITEM) & (self.count>0)
+        for d in range(self.depth.max(),-1,-1):
+            nodes = numpy.nonzero(strips & (self.depth==d))[0]
+            if not len(nodes):
+                continue
+            starts = self.first[nodes]
+            bounds = numpy.column_stack((starts,
+                                         starts+self.count[nodes])).ravel()
+            # the even entries reduce the child ranges
+            w_sum = numpy.add.reduceat(w,bounds)[::2]
+            w_max = numpy.maximum.reduceat(w,bounds)[::2]
+            h_sum = numpy.add.reduceat(h,bounds)[::2]
+            h_max = numpy.maximum.reduceat(h,bounds)[::2]
+            horizontal = self.kind[nodes]==HSTRIP
+            w[nodes] = numpy.where(horizontal,w_sum,w_max)
+            h[nodes] = numpy.where(horizontal,h_max,h_sum)
+        self.w = w[:n]
+        self.h = h[:n]
+
+    def _python_sizes(self):
+        n = len(self.kind)
+        w = array.array('d',[0])*n
+        h = array.array('d',[0])*n
+        kind = self.kind
+        # the children come after their parents
+        for i in xrange(n-1,-1,-1):
+            if kind[i]==ITEM:
+                t = self.type[i]
+                if self.rotated[i]:
+                    w[i],h[i] = self.type_h[t],self.type_w[t]
+                else:
+                    w[i],h[i] = self.type_w[t],self.type_h[t]
+                continue
+            sw = sh = 0
+            start = self.first[i]
+            if kind[i]==HSTRIP:
+                for j in xrange(start,start+self.count[i]):
+                    sw += w[j]
+                    sh = max(sh,h[j])
+            else:
+                for j in xrange(start,start+self.count[i]):
+                    sw = max(sw,w[j])
+                    sh += h[j]
+            w[i] = sw
+            h[i] = sh
+        self.w = w
+        self.h = h
+
+    def sizes(self):
+        "Return the (w, h) of each tree, computing the sizes if needed."
+        if self.w is None:
+            self.update_sizes()
+        return [(self.w[i],self.h[i]) for i in self.roots]
+
+    def strip(self,k):
+        """
+        Return tree k as HStrip and VStrip objects. The items keep their
+        types, rotations and ids; the dimensions are left for
+        update_dimensions().
+        """
+        root = self.roots[k]
+        nodes = {}
+        end = len(self.kind)
+        if k+1<len(self.roots):
+            end = self.roots[k+1]
+        for i in xrange(end-1,root-1,-1):
+            if self.kind[i]==ITEM:
+                nodes[i] = Item(self.types[self.type[i]],
+                                rotated=bool(self.rotated[i]),
+                                id_=self.ids[i])
+            else:
+                start = self.first[i]
+                nodes[i] = _classes[self.kind[i]](
+                    list_=[nodes.pop(j)
+                           for j in xrange(start,start+self.count[i])])
+        return nodes[root]
+
+    def strips(self):
+        "Return all the trees as HStrip and VStrip objects."
+        return [self.strip(k) for k in range(len(self))]
+
+
+def from_population(individuals):
+    "Encode the strip trees of the StripChromosome individuals."
+    return FlatStrips([c.strip for c in individuals])
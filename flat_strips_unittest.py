@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+import unittest
+import random
+from striped_ga import *
+from flat_strips import *
+import flat_strips
+
+numpy = flat_strips.numpy
+
+def population(n,seed):
+    random.seed(seed)
+    types = [ItemType(w,h) for w,h in
+             [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+    StripChromosome.items = [Item(t) for t in types for k in range(4)]
+    StripChromosome.H = 800
+    StripChromosome.W = 1e6
+    StripChromosome.item_min_dim = 100
+    return [StripChromosome() for i in range(n)]
+
+class TestSequenceFunctions(unittest.TestCase):
+    def test_sizes(self):
+        """the sizes of every node are those of update_sizes"""
+        individuals = population(10,1)
+        flat = from_population(individuals)
+        self.assertEqual(len(flat),10)
+        flat.update_sizes()
+        for k,c in enumerate(individuals):
+            self.assertEqual(flat.sizes()[k],(c.strip.w,c.strip.h))
+        for i,k in enumerate(flat.kind):
+            if k==ITEM:
+                continue
+            self.assert_(flat.parent[i]<i)
+            for j in range(flat.first[i],flat.first[i]+flat.count[i]):
+                self.assertEqual(flat.parent[j],i)
+
+    def test_round_trip(self):
+        """the trees convert back to the same layouts"""
+        individuals = population(5,2)
+        flat = from_population(individuals)
+        for c,strip in zip(individuals,flat.strips()):
+            strip.update_dimensions(c.W,c.H)
+            self.assertEqual(repr(strip),repr(c.strip))
+            self.assertEqual([i.id for i in strip.get_items()],
+                             [i.id for i in c.strip.get_items()])
+
+    @unittest.skipUnless(numpy,'NumPy is not installed')
+    def test_numpy_sizes(self):
+        """the vectorized sizes are those of the node loop"""
+        individuals = population(10,3)
+        flat = from_population(individuals)
+        flat._numpy_sizes()
+        w,h = list(flat.w),list(flat.h)
+        flat._python_sizes()
+        self.assertEqual(w,list(flat.w))
+        self.assertEqual(h,list(flat.h))
+        self.assertEqual(flat.sizes(),[(c.strip.w,c.strip.h)
+                                       for c in individuals])
+
+    def test_empty_strip(self):
+        s = HStrip(list_=[VStrip(),Item(ItemType(100,200),rotated=True)])
+        flat = FlatStrips([s])
+        self.assertEqual(flat.sizes(),[(200,100)])
+        self.assertEqual(repr(flat.strip(0)),repr(s))
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSequenceFunctions)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -3,6 +3,7 @@
 import copy
 import sys
 import math
+import time
 
 #import psyco
 #psyco.full()
@@ -176,7 +177,25 @@ class Segment(Region):
 
 
     
-def optimize_HRBB(I,W,alpha,verbose=False,segments_only=False):
+def optimize_HRBB(I,W,alpha,verbose=False,segments_only=False,
+                  time_budget=None,progress=None,stop=None,cutoff=None):
+    """
+    Find the shortest plate length for the items by bisection.
+
+    Once a complete layout has been found, the search stops after
+    time_budget seconds (if given) and returns the best layout so far.
+    progress is called with the length, the fill rate and the items of
+    each complete layout found.
+
+    stop is polled between the bisection steps and cancels the search
+    when true. cutoff returns the length of the best layout known
+    elsewhere; only shorter layouts are searched for. If either is
+    given and no complete layout is found, (None, []) is returned.
+    """
+    deadline = None
+    if time_budget is not None:
+        deadline = time.time()+time_budget
+
     # arrange the items in descending order of their areas
     I.sort(reverse=True,key=lambda x: x.w*x.l)
     N = len(I)
@@ -195,6 +214,21 @@ def optimize_HRBB(I,W,alpha,verbose=False,segments_only=False):
     b = Lmax
     Items = {}
     while b-a>1:
+        if cutoff is not None:
+            best = cutoff()
+            if best<b:
+                b = int(math.ceil(best))
+            if b-a<=1:
+                break
+        if stop is not None and stop():
+            if verbose:
+                sys.stderr.write("cancelled\n")
+            break
+        if deadline is not None and b in Items and time.time()>=deadline:
+            if verbose:
+                sys.stderr.write("time budget exhausted\n")
+            items = Items[b]
+            break
         c = (a+b)/2
         Vs = S-0.1
         if verbose:
@@ -214,10 +248,15 @@ def optimize_HRBB(I,W,alpha,verbose=False,segments_only=False):
             b = c
             if verbose:
                 sys.stderr.write("< ")
+            if progress is not None:
+                progress(c,float(S)/(c*W),Items[c])
     c = b
     if verbose:
         sys.stderr.write("= %d\n" % (c,))
-    #items = Items[c]
+    if c in Items:
+        items = Items[c]
+    elif stop is not None or cutoff is not None:
+        return None,[]
     
     #if len(items)==N:
     #    plot_layout(items,c,W)
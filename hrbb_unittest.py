@@ -83,6 +83,30 @@ class TestSequenceFunctions(unittest.TestCase):
         self.assertEqual(N,len(items))
         self.assertTrue(r.contains(items))
         self.assertFalse(overlap(items))
+
+    def test_optimize_progress(self):
+        pool = [Item(1540,700),Item(650,1502),Item(301,762),
+                Item(300,300),Item(400,400)]
+        found = []
+        progress = lambda L,fillrate,items: found.append((L,len(items)))
+        L,items = optimize_HRBB(pool,1830,2.0,progress=progress)
+        self.assert_(len(found)>0)
+        lengths = [f[0] for f in found]
+        self.assertEqual(lengths,sorted(lengths,reverse=True))
+        self.assertEqual(lengths[-1],L)
+        self.assertEqual(found[-1][1],len(pool))
+
+    def test_optimize_time_budget(self):
+        pool = [Item(1540,700),Item(650,1502),Item(301,762),
+                Item(300,300),Item(400,400)]
+        found = []
+        progress = lambda L,fillrate,items: found.append(L)
+        L,items = optimize_HRBB(pool,1830,2.0,time_budget=0.,
+                                progress=progress)
+        # stops at the first complete layout
+        self.assertEqual(found,[L])
+        self.assertEqual(len(items),len(pool))
+        self.assertFalse(overlap(items))
                 
 if __name__ == '__main__':
     unittest.main()
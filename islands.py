@@ -0,0 +1,211 @@
+#! /usr/bin/python
+
+# Island model for the pygena genetic algorithm library
+
+# Copyright (c) 2007-2010 Matti Airas
+
+# Licensed under the PSF License
+
+"""
+Run several pygena populations (islands) in separate processes and
+periodically migrate the best individuals of each island to the next
+one in a ring.
+
+Migration is asynchronous: an island sends its emigrants and takes in
+whatever has arrived from its neighbour by then, so islands never wait
+for each other. The migrants are carried by a transport object;
+QueueTransport works within one machine and SocketTransport stands in
+for islands running on separate nodes.
+"""
+
+import multiprocessing
+import Queue
+import socket
+import select
+import cPickle
+import random as r
+import pygena
+
+
+class QueueTransport(object):
+    "Carry the migrants in multiprocessing queues."
+
+    def __init__(self,islands):
+        self.queues = [multiprocessing.Queue() for i in range(islands)]
+
+    def open(self,island):
+        """
+        Prepare the transport for use in the island process.
+
+        Migration is best effort, so the island may exit without
+        waiting for its neighbour to consume the queued migrants.
+        """
+        for q in self.queues:
+            q.cancel_join_thread()
+
+    def send(self,island,migrants):
+        self.queues[(island+1)%len(self.queues)].put(migrants)
+
+    def receive(self,island):
+        "Return the migrants received so far."
+        migrants = []
+        while True:
+            try:
+                migrants += self.queues[island].get_nowait()
+            except Queue.Empty:
+                return migrants
+
+    def close(self,island=None):
+        pass
+
+
+class SocketTransport(object):
+    """
+    Carry the migrants over TCP connections. Each island listens on
+    its own address; a message is a pickled list of migrants sent over
+    a connection of its own.
+    """
+
+    def __init__(self,islands,host='127.0.0.1'):
+        self.listeners = []
+        for i in range(islands):
+            s = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+            s.bind((host,0))
+            s.listen(islands)
+            self.listeners.append(s)
+        self.addresses = [s.getsockname() for s in self.listeners]
+
+    def open(self,island):
+        "Keep only the own listener open in the island process."
+        for i,s in enumerate(self.listeners):
+            if i!=island:
+                s.close()
+
+    def send(self,island,migrants):
+        address = self.addresses[(island+1)%len(self.addresses)]
+        try:
+            conn = socket.create_connection(address)
+            conn.sendall(cPickle.dumps(migrants,2))
+            conn.close()
+        except socket.error:
+            # the neighbour has already finished
+            pass
+
+    def receive(self,island):
+        "Return the migrants received so far."
+        listener = self.listeners[island]
+        migrants = []
+        while select.select([listener],[],[],0)[0]:
+            conn,address = listener.accept()
+            f = conn.makefile('rb')
+            migrants += cPickle.loads(f.read())
+            f.close()
+            conn.close()
+        return migrants
+
+    def close(self,island=None):
+        "Close the listeners (only the own one within an island)."
+        if island is None:
+            for s in self.listeners:
+                s.close()
+        else:
+            self.listeners[island].close()
+
+
+def _island(island,kind,seed,transport,migration_interval,migrants,
+            results,halt,improvements,stats_file,kw):
+    """
+    Evolve one island population (run in a separate process). The
+    final best individual and, if improvements, each improvement are
+    put to results; the island stops when halt is set.
+    """
+    r.seed(seed)
+    transport.open(island)
+    kw['stop'] = halt.is_set
+    if improvements:
+        kw['on_improvement'] = \
+            lambda best: results.put(('improvement',island,best))
+    if stats_file:
+        kw['stats_file'] = '%s.%d' % (stats_file,island)
+    env = pygena.Population(kind,**kw)
+    while not env.goal():
+        env.step()
+        if env.generation % migration_interval == 0:
+            transport.send(island,env.emigrants(migrants))
+            env.immigrate(transport.receive(island))
+    env.report()
+    env.close()
+    transport.close(island)
+    results.put(('best',island,env.best()))
+
+def run_islands(kind,islands=4,migration_interval=5,migrants=2,
+                transport=QueueTransport,on_improvement=None,stop=None,
+                stats_file=None,poll_interval=0.1,**kw):
+    """
+    Run an island model genetic algorithm and return the best
+    individual found on any of the islands.
+
+    kind                the chromosome class
+    islands             the number of islands (processes)
+    migration_interval  generations between migrations
+    migrants            the number of best individuals sent each time
+    transport           factory taking the number of islands
+    on_improvement      called with each individual better than any
+                        found before on any island
+    stop                the islands stop when stop() returns true
+    stats_file          island i appends its records to stats_file.i
+    poll_interval       seconds between the calls to stop()
+    kw                  keyword arguments for each pygena.Population
+
+    on_improvement and stop are called in this process. An island
+    failing with an exception is left out of the result; if all of
+    them fail, RuntimeError is raised.
+    """
+    kw.setdefault('report_callback',pygena.quiet_report)
+    transport = transport(islands)
+    results = multiprocessing.Queue()
+    halt = multiprocessing.Event()
+    processes = []
+    for i in range(islands):
+        p = multiprocessing.Process(target=_island,
+                                    args=(i,kind,r.getrandbits(32),
+                                          transport,migration_interval,
+                                          migrants,results,halt,
+                                          on_improvement is not None,
+                                          stats_file,kw))
+        p.start()
+        processes.append(p)
+    transport.close()
+
+    # collect the results before joining, so that no island blocks
+    # while flushing its result to the queue
+    bests = [None]*islands
+    best = None
+    sign = (-1,1)[kind.optimization==pygena.MINIMIZE]
+    finished = [False]*islands
+    while not all(finished):
+        if stop is not None and not halt.is_set() and stop():
+            halt.set()
+        try:
+            message,island,individual = results.get(timeout=poll_interval)
+        except Queue.Empty:
+            # an island exiting normally has put its result already
+            for i,p in enumerate(processes):
+                if p.exitcode:
+                    finished[i] = True
+            continue
+        if message == 'best':
+            bests[island] = individual
+            finished[island] = True
+        elif best is None or sign*individual.score < sign*best.score:
+            best = individual
+            on_improvement(best)
+    for p in processes:
+        p.join()
+
+    bests = [best for best in bests if best is not None]
+    if not bests:
+        raise RuntimeError('all islands failed')
+    bests.sort()
+    return bests[0]
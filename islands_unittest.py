@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+import unittest
+import random
+import multiprocessing
+import tempfile
+import shutil
+import os
+import pygena
+from islands import *
+from pygena_unittest import BitChromosome
+
+class FailingChromosome(BitChromosome):
+    "A BitChromosome whose mutation fails failures times in all."
+    failures = None
+
+    def mutate(self,mutation_rate):
+        with self.failures.get_lock():
+            failing = self.failures.value > 0
+            if failing:
+                self.failures.value -= 1
+        if failing:
+            raise ValueError('mutation failed')
+        BitChromosome.mutate(self,mutation_rate)
+
+def run(transport):
+    random.seed(1)
+    return run_islands(BitChromosome,islands=3,migration_interval=2,
+                       migrants=2,transport=transport,
+                       size=20,maxgenerations=10,maxplateau=None,
+                       tournament=pygena.roulette_tournament)
+
+class TestSequenceFunctions(unittest.TestCase):
+    def test_queue_transport(self):
+        best = run(QueueTransport)
+        self.assert_(isinstance(best,BitChromosome))
+        self.assertEqual(best.score,best.bits.count(0))
+
+    def test_socket_transport(self):
+        best = run(SocketTransport)
+        self.assert_(isinstance(best,BitChromosome))
+        self.assertEqual(best.score,best.bits.count(0))
+
+    def test_on_improvement(self):
+        """the improvements of every island reach this process"""
+        improvements = []
+        random.seed(1)
+        best = run_islands(BitChromosome,islands=3,migration_interval=2,
+                           size=20,maxgenerations=10,maxplateau=None,
+                           on_improvement=lambda c:
+                               improvements.append(c.score))
+        self.assert_(improvements)
+        self.assertEqual(improvements,sorted(improvements,reverse=True))
+        self.assertEqual(len(set(improvements)),len(improvements))
+        self.assertEqual(improvements[-1],best.score)
+
+    def test_stop(self):
+        random.seed(1)
+        best = run_islands(BitChromosome,islands=2,size=20,
+                           maxgenerations=100000,maxplateau=None,
+                           stop=lambda: True)
+        self.assert_(isinstance(best,BitChromosome))
+
+    def test_stats_files(self):
+        """each island appends to a stats file of its own"""
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d,'stats')
+            random.seed(1)
+            run_islands(BitChromosome,islands=2,size=20,maxgenerations=3,
+                        maxplateau=None,stats_file=path)
+            self.assertEqual(sorted(os.listdir(d)),['stats.0','stats.1'])
+            for i in range(2):
+                lines = open('%s.%d' % (path,i)).readlines()
+                self.assertEqual(len(lines),3)
+        finally:
+            shutil.rmtree(d)
+
+    def test_failing_island(self):
+        """a failing island neither hangs the run nor gives its result"""
+        FailingChromosome.failures = multiprocessing.Value('i',1)
+        random.seed(1)
+        best = run_islands(FailingChromosome,islands=3,size=20,
+                           maxgenerations=5,maxplateau=None)
+        self.assert_(isinstance(best,FailingChromosome))
+        FailingChromosome.failures = multiprocessing.Value('i',1000)
+        self.assertRaises(RuntimeError,run_islands,FailingChromosome,
+                          islands=2,size=20,maxgenerations=5,
+                          maxplateau=None)
+
+    def test_socket_migration(self):
+        t = SocketTransport(2)
+        t.send(0,[1,2])
+        t.send(0,[3])
+        self.assertEqual(t.receive(1),[1,2,3])
+        self.assertEqual(t.receive(0),[])
+        t.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
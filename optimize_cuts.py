@@ -61,6 +61,9 @@ if __name__=='__main__':
                       help="maximum plate length as "
                       "a multiple of minimum surface area",
                       default=2.0)
+    parser.add_option("--time-budget",dest="time_budget",type="float",
+                      help="stop searching after this many seconds",
+                      default=None)
     
     (options,args) = parser.parse_args()
     W = options.width
@@ -70,7 +73,8 @@ if __name__=='__main__':
 
     items = input_items(args[0],options.trim)
     L,items = optimize_HRBB(items,W+trim,alpha,verbose=True,
-                            segments_only=seg)
+                            segments_only=seg,
+                            time_budget=options.time_budget)
 
     # remove the trim from the pieces
     L -= trim
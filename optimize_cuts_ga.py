@@ -1,8 +1,7 @@
 #!/usr/bin/env python
 
 import sys
-import striped_ga as optalg
-#import segmented_ga as optalg
+import striped_ga
 from optparse import OptionParser
 from pyparsing import *
 from itemplot import *
@@ -33,9 +32,9 @@ def input_items(filename):
     
     for line in lines:
         w,h,n,r,s = line
-        typ = optalg.ItemType(w, h, s, r)
+        typ = striped_ga.ItemType(w, h, s, r)
         for i in range(n):
-            items.append(optalg.Item(typ))
+            items.append(striped_ga.Item(typ))
                 
     return items
 
@@ -101,6 +100,47 @@ if __name__=='__main__':
     parser.add_option("-p","--pop_size",dest="pop_size",type="int",
                       help="the size of the population",
                       default=100)
+    parser.add_option("-j","--workers",dest="workers",type="int",
+                      help="the number of worker processes",
+                      default=None)
+    parser.add_option("-i","--islands",dest="islands",type="int",
+                      help="the number of island populations",
+                      default=None)
+    parser.add_option("--cache-size",dest="cache_size",type="int",
+                      help="the number of repaired layouts to cache",
+                      default=None)
+    parser.add_option("--reject-duplicates",dest="reject_duplicates",
+                      action="store_true",default=False,
+                      help="keep identical layouts out of the population")
+    parser.add_option("--stats",dest="stats_file",
+                      help="append per generation statistics to a JSONL file",
+                      default=None)
+    parser.add_option("--checkpoint",dest="checkpoint",
+                      help="save the population state periodically to a file",
+                      default=None)
+    parser.add_option("--checkpoint-interval",dest="checkpoint_interval",
+                      type="int",default=10,
+                      help="generations between checkpoints")
+    parser.add_option("--resume",dest="resume",action="store_true",
+                      default=False,
+                      help="continue the run saved in the checkpoint file")
+    parser.add_option("--steady-state",dest="steady_state",
+                      action="store_true",default=False,
+                      help="replace the worst individuals in place")
+    parser.add_option("--time-budget",dest="time_budget",type="float",
+                      help="stop the optimization after this many seconds",
+                      default=None)
+    parser.add_option("--crowding",dest="crowding",type="int",
+                      help="replace the most similar of this many "
+                      "individuals with each offspring",
+                      default=None)
+    parser.add_option("--local-search",dest="local_search",type="int",
+                      help="improve this many best layouts by local moves "
+                      "each generation",
+                      default=0)
+    parser.add_option("--local-search-steps",dest="local_search_steps",
+                      type="int",default=20,
+                      help="local moves tried per improved layout")
     
     (options,args) = parser.parse_args()
     H = options.height
@@ -109,14 +149,40 @@ if __name__=='__main__':
     randomize = options.randomize
     plot_result = options.plot_result
     pop_size = options.pop_size
+    workers = options.workers
+    islands = options.islands
+    cache_size = options.cache_size
+    reject_duplicates = options.reject_duplicates
+    stats_file = options.stats_file
+    checkpoint = options.checkpoint
+    resume = options.resume
+    if resume and not checkpoint:
+        parser.error("--resume requires --checkpoint")
+    if islands and (workers or checkpoint or resume):
+        parser.error("--islands cannot be combined with --workers, "
+                     "--checkpoint or --resume")
 
     items = input_items(args[0])
 
     add_trim(items,trim)
     
-    W,items = optalg.optimize(items,H+trim,generations=generations,
-                              randomize=randomize,
-                              pop_size=pop_size,verbose=True)
+    W,items = striped_ga.optimize(items,H+trim,generations=generations,
+                                  randomize=randomize,
+                                  pop_size=pop_size,workers=workers,
+                                  islands=islands,cache_size=cache_size,
+                                  reject_duplicates=reject_duplicates,
+                                  stats_file=stats_file,
+                                  checkpoint=checkpoint,
+                                  checkpoint_interval=\
+                                      options.checkpoint_interval,
+                                  resume=resume,
+                                  steady_state=options.steady_state,
+                                  time_budget=options.time_budget,
+                                  crowding=options.crowding,
+                                  local_search=options.local_search,
+                                  local_search_steps=\
+                                      options.local_search_steps,
+                                  verbose=True)
 
     # verify the result
 
@@ -0,0 +1,233 @@
+#! /usr/bin/python
+
+# Portfolio of layout engines
+
+# Copyright (c) 2007-2010 Matti Airas
+
+# Licensed under the PSF License
+
+"""
+Run several layout engines with several seeds concurrently on the same
+part list and return the shortest layout found.
+
+The engines share the best known length: hrbb uses it as a cutoff and
+only searches for shorter layouts. The cutoff is hrbb only, as the
+genetic engines have no search to prune; they take part by reporting
+their improvements to the shared length. When a layout reaches the lower
+bound or the time budget is exhausted, the remaining runs are told to
+stop and return their best layout so far; runs still going after a
+grace period are terminated.
+
+A part is a tuple (w, h, n, rotatable, text) in the coordinates of
+striped_ga: w is along the strip length and h along the fixed height
+H. The layouts are returned as lists of (x, y, w, h, text) tuples in
+the same coordinates, whatever the engine.
+"""
+
+import time
+import traceback
+import multiprocessing
+import random as r
+from collections import namedtuple
+import striped_ga
+import segmented_ga
+import hrbb
+
+# error is the formatted traceback of a failed run, otherwise None
+Result = namedtuple('Result', 'engine seed length layout time error')
+
+# the shared best known length and the stop event of the worker
+# processes, set up by _init
+_best = None
+_stop = None
+
+def _init(best,stop):
+    global _best, _stop
+    _best = best
+    _stop = stop
+
+def lower_bound(parts,H):
+    "Return a lower bound for the strip length of the parts."
+    area = sum([w*h*n for w,h,n,rotatable,text in parts])
+    longest = 0
+    for w,h,n,rotatable,text in parts:
+        # the shortest length of the part in an orientation that fits
+        lengths = [w]
+        if rotatable and w<=H:
+            lengths = [l for l,d in [(w,h),(h,w)] if d<=H]
+        longest = max(longest,min(lengths))
+    return max(float(area)/H,longest)
+
+def _striped(parts,H,time_budget,progress,stop,**kw):
+    items = []
+    for w,h,n,rotatable,text in parts:
+        typ = striped_ga.ItemType(w,h,text,rotatable)
+        items += [striped_ga.Item(typ) for i in range(n)]
+    length,items = striped_ga.optimize(items,H,time_budget=time_budget,
+                                       progress=progress,stop=stop,**kw)
+    return length,[(i.x,i.y,i.w,i.h,i.text) for i in items]
+
+def _segmented(parts,H,time_budget,progress,stop,**kw):
+    # the segmented regions are W wide and grow in length
+    items = []
+    for w,h,n,rotatable,text in parts:
+        typ = segmented_ga.ItemType(h,w,text,rotatable)
+        items += [segmented_ga.Item(typ) for i in range(n)]
+    length,items = segmented_ga.optimize(items,H,time_budget=time_budget,
+                                         progress=progress,stop=stop,**kw)
+    return length,[(i.x,i.y,i.l,i.w,i.type.description) for i in items]
+
+def _hrbb(parts,H,time_budget,progress,stop,alpha=2.0,**kw):
+    items = []
+    for w,h,n,rotatable,text in parts:
+        items += [hrbb.Item(w,h,rotatable=rotatable,s=text)
+                  for i in range(n)]
+    length,items = hrbb.optimize_HRBB(items,H,alpha,time_budget=time_budget,
+                                      progress=progress,stop=stop,
+                                      cutoff=lambda: _best.value,**kw)
+    return length,[(i.x,i.y,i.l,i.w,i.s) for i in items]
+
+ENGINES = {
+    'striped': _striped,
+    'segmented': _segmented,
+    'hrbb': _hrbb,
+    }
+
+# engines giving the same layout with every seed
+DETERMINISTIC = set(['hrbb'])
+
+def _run_engine(task):
+    """
+    Run one engine (in a worker process) and return a Result. A run
+    raising an exception is returned as a failed Result, so that it
+    does not take the other runs down.
+    """
+    engine,seed,parts,H,bound,deadline,kw = task
+    start = time.time()
+    time_budget = None
+    if deadline is not None:
+        time_budget = deadline-start
+        if time_budget<=0:
+            return Result(engine,seed,None,None,0.,None)
+    if _stop.is_set():
+        return Result(engine,seed,None,None,0.,None)
+    r.seed(seed)
+
+    def progress(length,fillrate,items):
+        with _best.get_lock():
+            if length<_best.value:
+                _best.value = length
+        if length<=bound:
+            _stop.set()
+
+    try:
+        length,layout = ENGINES[engine](parts,H,time_budget,progress,
+                                        _stop.is_set,**kw)
+    except Exception:
+        return Result(engine,seed,None,None,time.time()-start,
+                      traceback.format_exc())
+    if length is None:
+        layout = None
+    return Result(engine,seed,length,layout,time.time()-start,None)
+
+def engine_stats(results):
+    """
+    Return the per-engine statistics of the results. The runs neither
+    completed nor failed were cancelled; errors holds the tracebacks of
+    the failed ones.
+    """
+    stats = {}
+    for res in results:
+        s = stats.setdefault(res.engine,dict(runs=0,completed=0,failed=0,
+                                             errors=[],best=None,
+                                             mean_length=None,
+                                             mean_time=None))
+        s['runs'] += 1
+        if res.error is not None:
+            s['failed'] += 1
+            s['errors'].append(res.error)
+    for engine,s in stats.items():
+        done = [res for res in results
+                if res.engine==engine and res.length is not None]
+        s['completed'] = len(done)
+        if done:
+            lengths = [res.length for res in done]
+            s['best'] = min(lengths)
+            s['mean_length'] = sum(lengths)/float(len(lengths))
+            s['mean_time'] = sum([res.time for res in done])/len(done)
+    return stats
+
+def run_portfolio(parts,H,engines=('striped','segmented','hrbb'),seeds=2,
+                  workers=None,time_budget=None,grace=1.0,options=None,
+                  poll_interval=0.05):
+    """
+    Run the engines on the parts and return the best Result and the
+    per-engine statistics.
+
+    parts          the parts as (w, h, n, rotatable, text) tuples
+    H              the strip height
+    engines        the names of the engines to run
+    seeds          the number of runs (seeds) of each randomized engine
+    workers        the number of worker processes (default: CPU count)
+    time_budget    seconds until the runs are told to stop
+    grace          seconds to wait for stopped runs before terminating
+    options        engine name -> keyword arguments for its optimizer
+
+    The best Result is None if no run completed. Cancelled and failed
+    runs have length None; failed runs have the traceback as error.
+    """
+    if options is None:
+        options = {}
+    start = time.time()
+    deadline = None
+    if time_budget is not None:
+        deadline = start+time_budget
+    bound = lower_bound(parts,H)
+
+    tasks = []
+    for engine in engines:
+        n = (seeds,1)[engine in DETERMINISTIC]
+        for i in range(n):
+            tasks.append((engine,r.getrandbits(32),parts,H,bound,deadline,
+                          options.get(engine,{})))
+
+    best = multiprocessing.Value('d',float('inf'))
+    stop = multiprocessing.Event()
+    pool = multiprocessing.Pool(workers,_init,(best,stop))
+    pending = [(task,pool.apply_async(_run_engine,(task,)))
+               for task in tasks]
+    results = []
+    kill_time = None
+    try:
+        while pending:
+            now = time.time()
+            if kill_time is None and \
+                    (stop.is_set() or deadline is not None and
+                     now>=deadline):
+                stop.set()
+                kill_time = now+grace
+            if kill_time is not None and now>=kill_time:
+                break
+            running = []
+            for task,result in pending:
+                if result.ready():
+                    results.append(result.get())
+                else:
+                    running.append((task,result))
+            pending = running
+            if pending:
+                time.sleep(poll_interval)
+    finally:
+        if pending:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    for task,result in pending:
+        results.append(Result(task[0],task[1],None,None,None,None))
+
+    done = [res for res in results if res.length is not None]
+    winner = None
+    if done:
+        winner = min(done,key=lambda res: res.length)
+    return winner,engine_stats(results)
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+import unittest
+import random
+from portfolio import *
+
+parts = [(400,300,2,True,"a"),
+         (300,200,3,True,"b"),
+         (200,100,4,False,"c")]
+H = 600
+
+options = {'striped': dict(generations=5,plateau=None,pop_size=10)}
+
+def overlaps(a,b):
+    return a[0]<b[0]+b[2] and b[0]<a[0]+a[2] and \
+        a[1]<b[1]+b[3] and b[1]<a[1]+a[3]
+
+class TestSequenceFunctions(unittest.TestCase):
+    def test_lower_bound(self):
+        self.assertEqual(lower_bound(parts,H),(240000+180000+80000)/600.)
+        self.assertEqual(lower_bound([(10,800,1,True,"")],H),800)
+        self.assertEqual(lower_bound([(500,10,1,True,"")],H),10)
+        self.assertEqual(lower_bound([(800,10,1,False,"")],H),800)
+
+    def test_failed_run(self):
+        """a run raising an exception does not stop the others"""
+        failing = [(700,50,2,False,'d'),(150,550,1,True,'e')]
+        random.seed(1)
+        winner,stats = run_portfolio(failing,H,
+                                     engines=('segmented','striped'),
+                                     seeds=1,workers=2,time_budget=20,
+                                     options=options)
+        self.assertEqual(stats['segmented']['runs'],1)
+        self.assertEqual(stats['segmented']['completed'],0)
+        self.assertEqual(stats['segmented']['failed'],1)
+        self.assert_('AssertionError' in stats['segmented']['errors'][0])
+        self.assertEqual(stats['striped']['failed'],0)
+        self.assertEqual(winner.engine,'striped')
+        self.assertEqual(winner.error,None)
+
+    def test_portfolio(self):
+        random.seed(1)
+        winner,stats = run_portfolio(parts,H,engines=('striped','hrbb'),
+                                     seeds=2,workers=2,time_budget=20,
+                                     options=options)
+        self.assertEqual(stats['striped']['runs'],2)
+        self.assertEqual(stats['hrbb']['runs'],1)
+        self.assertEqual(winner.length,
+                         min([s['best'] for s in stats.values()
+                              if s['best'] is not None]))
+        layout = winner.layout
+        self.assertEqual(len(layout),9)
+        for x,y,w,h,text in layout:
+            self.assert_(x+w<=winner.length+1e-6)
+            self.assert_(y+h<=H)
+        for i,a in enumerate(layout):
+            for b in layout[i+1:]:
+                self.failIf(overlaps(a,b))
+
+    def test_cancel(self):
+        """runs are stopped at the deadline"""
+        random.seed(1)
+        winner,stats = run_portfolio(parts,H,engines=('striped',),
+                                     seeds=1,workers=1,time_budget=0.,
+                                     grace=0.,options=options)
+        self.assertEqual(winner,None)
+        self.assertEqual(stats['striped']['runs'],1)
+        self.assertEqual(stats['striped']['completed'],0)
+        self.assertEqual(stats['striped']['failed'],0)
+
+
+if __name__ == '__main__':
+    unittest.main()
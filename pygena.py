@@ -11,7 +11,21 @@
 # Licensed under the PSF License
 
 import random as r
+import multiprocessing
+import time
+import json
+import os
+import gzip
+import cPickle
 from copy import deepcopy
+from collections import OrderedDict, namedtuple
+from bisect import bisect_left
+import heapq
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 MAXIMIZE, MINIMIZE = 11, 22
 
@@ -20,6 +34,11 @@ MAXIMIZE, MINIMIZE = 11, 22
 class BaseChromosome(object):
     optimization = MINIMIZE
     length = None # redefine in a subclass!
+    cache = None # FitnessCache of the Population running the class
+    # true if crossover() and mutate() take repair=False, leaving the
+    # offspring to a single repair() once they are complete, and
+    # crossover() takes wanted, the number of offspring to return
+    lazy_repair = False
 
     def __init__(self):
         self.score = None  # set during evaluation
@@ -42,6 +61,61 @@ class BaseChromosome(object):
     def asString(self):
         raise NotImplementedError
 
+    def local_search(self,steps):
+        """
+        Improve the chromosome in place by steps local moves, keeping
+        the score up to date. Required for the memetic stage.
+        """
+        raise NotImplementedError
+
+    def clone(self):
+        """
+        Return an independent copy of the chromosome. Override with
+        a cheaper copy than deepcopy where possible.
+        """
+        count('deepcopy')
+        return deepcopy(self)
+
+    @classmethod
+    def class_state(cls):
+        """
+        Return the class level configuration (e.g. the items to lay
+        out) to be saved in checkpoints.
+        """
+        return None
+
+    @classmethod
+    def set_class_state(cls,state):
+        "Restore the configuration returned by class_state()."
+        pass
+
+    def fingerprint(self):
+        """
+        Return a hashable key equal for structurally identical
+        chromosomes. Required for rejecting duplicates.
+        """
+        raise NotImplementedError
+
+    def signature(self):
+        """
+        Return a frozenset of features of the chromosome (e.g. item
+        adjacencies) for distance(). Cache it while the chromosome
+        does not change, as it is needed by every comparison.
+        """
+        raise NotImplementedError
+
+    def distance(self,other):
+        """
+        Return the share of signature features not common to both
+        chromosomes, from 0 (identical) to 1.
+        """
+        a = self.signature()
+        b = other.signature()
+        union = len(a|b)
+        if not union:
+            return 0.
+        return 1.-len(a&b)/float(union)
+
     def __repr__(self):
         "returns string representation of self"
         return '<%s chromosome="%s" score=%s>' % \
@@ -60,14 +134,185 @@ class BaseChromosome(object):
     #    return twin
 
 
+class Stats(object):
+    """
+    Instrumentation of one generation: the wall time spent in each
+    phase, excluding nested phases, and event counters.
+    """
+    def __init__(self):
+        self.times = {}
+        self.counters = {}
+        self.stack = []
+
+    def enter(self,name):
+        self.stack.append([name,time.time(),0.])
+
+    def leave(self):
+        name,start,nested = self.stack.pop()
+        elapsed = time.time()-start
+        self.times[name] = self.times.get(name,0.)+elapsed-nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0)+n
+
+    def merge(self,other):
+        "Add the times and counters of another instance."
+        for name,t in other.times.items():
+            self.times[name] = self.times.get(name,0.)+t
+        for name,n in other.counters.items():
+            self.count(name,n)
+
+# the Stats instance collecting data in this process, if any
+_stats = None
+
+def activate(stats):
+    "Make stats collect the instrumentation data. Returns the previous."
+    global _stats
+    previous = _stats
+    _stats = stats
+    return previous
+
+class phase(object):
+    """
+    Context manager timing a phase of the algorithm, e.g.
+
+        with pygena.phase('repair'):
+            ...
+    """
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        if _stats is not None:
+            _stats.enter(self.name)
+
+    def __exit__(self,*exc_info):
+        if _stats is not None:
+            _stats.leave()
+
+def count(name,n=1):
+    "Increment an instrumentation counter."
+    if _stats is not None:
+        _stats.count(name,n)
+
+
+# the state of a population after a generation, see Population.iter_run
+Snapshot = namedtuple('Snapshot','generation best_score median_score best')
+
+
+class FitnessCache(object):
+    """
+    Bounded least recently used mapping from chromosome keys to
+    repaired and evaluated results. Chromosomes consult it through
+    their class attribute cache, so that identical offspring skip
+    repair and evaluation.
+    """
+    def __init__(self,size=1000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self,key):
+        "Return the cached value or None, updating the counters."
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self,key,value):
+        self.entries.pop(key,None)
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def counts(self):
+        "Return (hits, misses)."
+        return self.hits, self.misses
+
+    def add_counts(self,counts):
+        "Add the (hits, misses) of a lookup made in another process."
+        self.hits += counts[0]
+        self.misses += counts[1]
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        if n == 0:
+            return 0.
+        return float(self.hits) / n
+
+
+def _selection_key(chromosome):
+    "sort key of an individual, smaller is better"
+    if chromosome.optimization == MINIMIZE:
+        return chromosome.score
+    else:
+        return -chromosome.score
+
+def _selection_keys(population):
+    "sort keys of the individuals, smaller is better"
+    if population[0].optimization == MINIMIZE:
+        return [c.score for c in population]
+    else:
+        return [-c.score for c in population]
+
+def best_indices(keys, k):
+    """
+    Return the indices of the k smallest keys, smallest first,
+    without sorting all of them.
+    """
+    if k >= len(keys):
+        return sorted(range(len(keys)), key=keys.__getitem__)
+    if numpy is not None:
+        indices = numpy.argpartition(numpy.asarray(keys), k)[:k].tolist()
+        return sorted(indices, key=keys.__getitem__)
+    return heapq.nsmallest(k, range(len(keys)), key=keys.__getitem__)
+
+def worst_indices(keys, k):
+    "Return the indices of the k largest keys, largest first."
+    return best_indices([-key for key in keys], k)
+
 def simple_tournament(population, size=8, choosebest=0.90):
     #competitors = [r.choice(population) for i in range(size)]
-    competitiors = r.sample(population,size)
+    competitors = r.sample(population,size)
     competitors.sort()
     if r.random() < choosebest:
         return competitors[0]
     else:
         return r.choice(competitors[1:])
+
+def simple_selection(population, n, size=8, choosebest=0.90):
+    """
+    Select n parents with simple_tournament. The population is ranked
+    once, so that each tournament only needs to find the best rank in
+    its sample.
+    """
+    keys = _selection_keys(population)
+    order = sorted(range(len(population)), key=keys.__getitem__)
+    rank = [0]*len(order)
+    for i,j in enumerate(order):
+        rank[j] = i
+    indices = range(len(population))
+    parents = []
+    for k in range(n):
+        competitors = r.sample(indices,size)
+        winner = min(competitors, key=rank.__getitem__)
+        if r.random() >= choosebest:
+            competitors.remove(winner)
+            winner = r.choice(competitors)
+        parents.append(population[winner])
+    return parents
+
+simple_tournament.batch = simple_selection
     
 def roulette_tournament(population):
     if population[0].optimization==MAXIMIZE:
@@ -84,6 +329,116 @@ def roulette_tournament(population):
         i += 1
     return population[i]
 
+def roulette_selection(population, n):
+    """
+    Select n parents with roulette_tournament. The cumulative weights
+    are computed once and each draw is a binary search.
+    """
+    if population[0].optimization==MAXIMIZE:
+        transform = lambda x: x**2
+    else:
+        transform = lambda x: 1/(x+1e-10)
+    cums = []
+    tot = 0
+    for p in population:
+        tot += transform(p.score)
+        cums.append(tot)
+    last = len(population)-1
+    return [population[min(bisect_left(cums,tot*r.random()),last)]
+            for i in range(n)]
+
+roulette_tournament.batch = roulette_selection
+
+def _cache_counts(cache):
+    "The (hits, misses) of cache, if any."
+    if cache is None:
+        return None
+    return cache.counts()
+
+def _cache_delta(cache,before):
+    "The (hits, misses) of cache since the counts before, if any."
+    if cache is None:
+        return None
+    hits, misses = cache.counts()
+    return hits-before[0], misses-before[1]
+
+def _use_cache(kind,cache):
+    "Set the fitness cache of the chromosome class (in a worker process)."
+    kind.cache = cache
+
+def _spawn(task):
+    """
+    Create a random chromosome (run in a worker process). Returns the
+    chromosome and the fitness cache counts of its repair.
+    """
+    seed, kind = task
+    r.seed(seed)
+    before = _cache_counts(kind.cache)
+    individual = kind()
+    return individual, _cache_delta(kind.cache,before)
+
+def _breed(task):
+    """
+    Produce the offspring of one mating (run in a worker process).
+
+    task is a tuple (seed, mutation_rate, mate1, mate2, wanted,
+    instrumented). If mate2 is None, mate1 is copied instead of crossed
+    over. Only the first wanted offspring are kept. The offspring are
+    mutated, which also repairs and evaluates them; with lazy_repair
+    only the wanted offspring are made, and repaired once, after the
+    mutation, and a copy only if it was mutated. Returns the offspring, their Stats if
+    instrumented and the fitness cache counts of their repairs.
+    """
+    seed, mutation_rate, mate1, mate2, wanted, instrumented = task
+    r.seed(seed)
+    before = _cache_counts(mate1.cache)
+    stats = None
+    if instrumented:
+        stats = Stats()
+    previous = activate(stats)
+    lazy = mate1.lazy_repair
+    with phase('crossover'):
+        if mate2 is None:
+            offspring = [mate1.clone()]
+        elif lazy:
+            offspring = mate1.crossover(mate2,repair=False,
+                                        wanted=wanted)
+        else:
+            offspring = mate1.crossover(mate2)
+    offspring = list(offspring)[:wanted]
+    with phase('mutation'):
+        for individual in offspring:
+            if not lazy:
+                individual.mutate(mutation_rate)
+            elif individual.mutate(mutation_rate,repair=False) or \
+                    mate2 is not None:
+                individual.repair()
+    activate(previous)
+    return offspring, stats, _cache_delta(mate1.cache,before)
+
+def _improve(task):
+    """
+    Improve a copy of an individual by local search (run in a worker
+    process).
+
+    task is a tuple (seed, individual, steps, instrumented). Returns
+    the copy and, if instrumented, its Stats.
+    """
+    seed, individual, steps, instrumented = task
+    r.seed(seed)
+    stats = None
+    if instrumented:
+        stats = Stats()
+    previous = activate(stats)
+    with phase('local_search'):
+        twin = individual.clone()
+        twin.local_search(steps)
+    activate(previous)
+    return twin, stats
+
+def quiet_report(self):
+    pass
+
 def default_report(self):
     print "="*70
     print "generation:   ", self.generation
@@ -92,6 +447,12 @@ def default_report(self):
     #    print p
     print "median score: ", median([c.score for c in self.population])
     print "best:         ", self.best()
+    diversity = self.diversity()
+    if diversity is not None:
+        print "diversity:    ", "%.3f" % diversity
+    if self.cache is not None:
+        print "cache:        ", "%d hits, %d misses, %d rejected" % \
+              (self.cache.hits, self.cache.misses, self.rejected)
 
 
 class Population(object):
@@ -99,10 +460,37 @@ class Population(object):
                  maxplateau=10,
                  crossover_rate=0.70, mutation_rate=0.01,
                  tournament=simple_tournament, elitism=True, optimum=None,
-                 report_callback=default_report):
+                 report_callback=default_report, workers=None,
+                 cache_size=None, reject_duplicates=False,
+                 instrument=None, stats_file=None,
+                 checkpoint=None, checkpoint_interval=10,
+                 steady_state=False, steady_offspring=2,
+                 time_budget=None, on_improvement=None, stop=None,
+                 crowding=None, local_search=0, local_search_steps=20,
+                 report_interval=1):
         self.kind = kind
+        # the time budget (in seconds) includes creating the population
+        self.deadline = None
+        if time_budget is not None:
+            self.deadline = time.time()+time_budget
         self.size = size
         self.optimum = optimum
+        # the cache is per population and per process; worker
+        # processes fill their own, and in this process map() hands it
+        # to the chromosome class while the tasks run
+        self.cache = None
+        if cache_size:
+            self.cache = FitnessCache(cache_size)
+        self.reject_duplicates = reject_duplicates
+        self.rejected = 0
+        # offspring are produced by tasks seeded from the main random
+        # stream, so the result for a given seed does not depend on
+        # the amount of worker processes
+        self.workers = workers
+        self.pool = None
+        if workers and workers>1:
+            self.pool = multiprocessing.Pool(workers,_use_cache,
+                                             (kind,self.cache))
         if population:
             self.population = population
         else:
@@ -115,32 +503,130 @@ class Population(object):
         self.prev_improvement_gen = 0
         self.prev_score = None
         self.elitism=elitism
+        # in steady state mode a step (generation) replaces only the
+        # steady_offspring worst individuals
+        self.steady_state = steady_state
+        self.steady_offspring = steady_offspring
+        # with crowding, offspring replace the most similar of crowding
+        # random individuals if not worse (restricted tournament
+        # replacement), which keeps the niches of the population
+        self.crowding = crowding
+        # each generation, the local_search best individuals are
+        # improved by local_search_steps local moves (memetic stage)
+        self.local_search = local_search
+        self.local_search_steps = local_search_steps
         self.tournament = tournament
+        # report_callback is called every report_interval generations
         self.report_callback = report_callback
-        self.population.sort()
+        self.report_interval = report_interval
+        # instrumentation records are passed to instrument and
+        # appended to stats_file as JSON lines
+        self.instrument = instrument
+        self.stats_file = None
+        if stats_file:
+            self.stats_file = open(stats_file,'a')
+        self.stats = None
+        # the state is saved to checkpoint every checkpoint_interval
+        # generations and at the end of run()
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        # the population is kept unsorted; keys holds the selection
+        # keys of the individuals, smaller is better
+        self.keys = None
+        self.best_index = None
+        self.update_keys()
+        # stop is polled before each generation; true cancels the run
+        self.stop = stop
+        # on_improvement is called with each new best individual
+        self.on_improvement = on_improvement
+        self.best_key = None
+        self.best_found = None
+        self.check_improvement()
 
 
     def make_population(self):
-        pop = []
-        for i in range(self.size):
-            ch = self.kind()
-            pop.append(ch)
-        return pop
-    
+        tasks = [(r.getrandbits(32),self.kind) for i in range(self.size)]
+        population = []
+        for individual,counts in self.map(_spawn,tasks):
+            self.merge_cache_counts(counts)
+            population.append(individual)
+        return population
+
+    def map(self,func,tasks):
+        """
+        Apply func to each task, in the worker pool if one is in use.
+
+        Tasks reseed the random number generator, so its state is
+        restored after running them in this process. The chromosome
+        class uses the fitness cache of this population meanwhile, so
+        that populations of the same class keep their own caches.
+        """
+        if self.pool is not None:
+            return self.pool.map(func,tasks)
+        state = r.getstate()
+        cache = self.kind.cache
+        self.kind.cache = self.cache
+        try:
+            results = [func(task) for task in tasks]
+        finally:
+            self.kind.cache = cache
+        r.setstate(state)
+        return results
+
+    def merge_cache_counts(self,counts):
+        """
+        Add the fitness cache counts of a task run in a worker process,
+        whose cache is its own; in this process they are counted
+        already.
+        """
+        if counts is not None and self.pool is not None:
+            self.cache.add_counts(counts)
+
+    def close(self):
+        "Shut down the worker pool, if any, and close the stats file."
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.stats_file is not None:
+            self.stats_file.close()
+            self.stats_file = None
+
     def run(self):
-        best = None
-        sign = (-1,1)[self.population[0].optimization==MAXIMIZE]
-        while not self.goal():
-            self.step()
-            if best is not None:
-                if sign*best.score<sign*self.best().score:
-                    best = self.best()
-            else:
-                best = self.best()
-        self.report()
-        return best
+        for snapshot in self.iter_run():
+            pass
+        return self.best_found
+
+    def iter_run(self,batch_size=None):
+        """
+        Run the algorithm as a generator yielding a Snapshot after each
+        generation, so that the caller decides when to continue.
+
+        With batch_size, generational offspring are bred in batches of
+        that size and None is yielded between the batches. Closing the
+        generator cancels the run at the next yield.
+        """
+        try:
+            while not self.goal():
+                for pause in self.iter_step(batch_size):
+                    yield None
+                yield self.snapshot()
+            self.report()
+            if self.checkpoint:
+                self.save_checkpoint(self.checkpoint)
+        finally:
+            self.close()
+
+    def snapshot(self):
+        scores = [c.score for c in self.population]
+        return Snapshot(self.generation,self.best().score,median(scores),
+                        self.best())
     
     def goal(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            return True
+        if self.stop is not None and self.stop():
+            return True
         sign = (-1,1)[self.population[0].optimization==MAXIMIZE]
         if self.prev_score is None:
             self.prev_score = sign*self.best().score
@@ -156,36 +642,323 @@ class Population(object):
                self.best().score == self.optimum
     
     def step(self):
-        self.report()
-        self.crossover()
-        self.population.sort()
+        for pause in self.iter_step():
+            pass
+
+    def iter_step(self,batch_size=None):
+        """
+        Advance one generation, yielding between the offspring batches
+        (see iter_run). The instrumentation is suspended while paused.
+        """
+        if self.generation % self.report_interval == 0:
+            self.report()
+        instrumented = self.instrument or self.stats_file
+        if instrumented:
+            self.stats = Stats()
+            activate(self.stats)
+            start = time.time()
+        if self.crowding:
+            self.replace_similar()
+        elif self.steady_state:
+            self.replace_worst()
+        else:
+            for pause in self.iter_crossover(batch_size):
+                if instrumented:
+                    activate(None)
+                    paused = time.time()
+                yield
+                if instrumented:
+                    start += time.time()-paused
+                    activate(self.stats)
+            with phase('sort'):
+                self.update_keys()
+        if self.local_search:
+            self.improve()
+        if instrumented:
+            activate(None)
+            self.record(time.time()-start)
         self.generation += 1
+        self.check_improvement()
+        if self.checkpoint and \
+               self.generation % self.checkpoint_interval == 0:
+            self.save_checkpoint(self.checkpoint)
+
+    def save_checkpoint(self,path):
+        """
+        Save the population, the generation and plateau counters, the
+        random number generator state and the chromosome class
+        configuration to a compressed pickle. The file is replaced
+        atomically, so a run killed while saving keeps the previous one.
+        """
+        state = {'population': self.population,
+                 'generation': self.generation,
+                 'prev_improvement_gen': self.prev_improvement_gen,
+                 'prev_score': self.prev_score,
+                 'random': r.getstate(),
+                 'class_state': self.kind.class_state()}
+        tmp = path + '.tmp'
+        f = gzip.open(tmp,'wb')
+        cPickle.dump(state,f,2)
+        f.close()
+        os.rename(tmp,path)
+
+    @classmethod
+    def resume(cls,kind,path,**kw):
+        """
+        Create a population from a checkpoint saved by save_checkpoint().
+        The keyword arguments are those of the constructor, so e.g.
+        the generation budget may be raised.
+        """
+        f = gzip.open(path,'rb')
+        state = cPickle.load(f)
+        f.close()
+        kind.set_class_state(state['class_state'])
+        env = cls(kind,population=state['population'],**kw)
+        env.generation = state['generation']
+        env.prev_improvement_gen = state['prev_improvement_gen']
+        env.prev_score = state['prev_score']
+        r.setstate(state['random'])
+        return env
+
+    def record(self,wall):
+        """
+        Deliver the instrumentation record of the generation. Phase
+        times from worker processes are summed over the workers.
+        """
+        rec = {'generation': self.generation,
+               'wall': wall,
+               'times': self.stats.times,
+               'counters': self.stats.counters}
+        if self.cache is not None:
+            rec['cache'] = {'hits': self.cache.hits,
+                            'misses': self.cache.misses}
+        diversity = self.diversity()
+        if diversity is not None:
+            rec['diversity'] = diversity
+        if self.instrument:
+            self.instrument(rec)
+        if self.stats_file is not None:
+            self.stats_file.write(json.dumps(rec)+"\n")
+            self.stats_file.flush()
+
+    def check_improvement(self):
+        "Pass a new best individual to on_improvement."
+        key = self.keys[self.best_index]
+        if self.best_key is None or key < self.best_key:
+            self.best_key = key
+            self.best_found = self.best()
+            if self.on_improvement is not None:
+                self.on_improvement(self.best())
+
+    def update_keys(self):
+        "Refresh the selection keys after changes to the population."
+        self.keys = _selection_keys(self.population)
+        self.best_index = self.keys.index(min(self.keys))
     
     def crossover(self):
+        for pause in self.iter_crossover():
+            pass
+
+    def iter_crossover(self,batch_size=None):
+        """
+        Replace the population with the next generation, yielding after
+        each batch of batch_size offspring if given.
+        """
         next_population = []
         if self.elitism==True:
-            for i in range(5):
-                next_population.append(deepcopy(self.population[i]))
+            for i in best_indices(self.keys,5):
+                next_population.append(self.population[i].clone())
+        seen = {}
+        if self.reject_duplicates:
+            for c in next_population:
+                seen[c.fingerprint()] = True
+        # stop rejecting once a population's worth has been rejected,
+        # as a converged population might not produce anything new
+        self.rejected = 0
         while len(next_population) < self.size:
-            mate1 = self.tournament(self.population)
-            if r.random() < self.crossover_rate:
-                mate2 = self.tournament(self.population)
-                offspring = mate1.crossover(mate2)
-            else:
-                offspring = [deepcopy(mate1)]
-            for individual in offspring:
-                individual.mutate(self.mutation_rate)
+            n = self.size-len(next_population)
+            if batch_size:
+                n = min(n,batch_size)
+            for individual in self.breed(n):
+                if self.reject_duplicates and self.rejected < self.size:
+                    key = individual.fingerprint()
+                    if key in seen:
+                        self.rejected += 1
+                        continue
+                    seen[key] = True
                 next_population.append(individual)
+            if len(next_population) < self.size:
+                yield
         self.population = next_population[:self.size]
-        
+
+    def breed(self,n,exact=False):
+        """
+        Produce n offspring, assuming a crossover produces two. When
+        only one more offspring is needed, the second child of the last
+        crossover is dropped before it is mutated or repaired; if exact,
+        that mating is a copy instead.
+        """
+        matings = []
+        planned = 0
+        while planned < n:
+            crossed = r.random() < self.crossover_rate
+            if exact and planned == n-1:
+                crossed = False
+            wanted = min((1,2)[crossed],n-planned)
+            matings.append((crossed,wanted))
+            planned += wanted
+        with phase('selection'):
+            parents = iter(self.select(len(matings)+
+                                       sum([c for c,w in matings])))
+        tasks = []
+        for crossed,wanted in matings:
+            mate1 = parents.next()
+            mate2 = None
+            if crossed:
+                mate2 = parents.next()
+            tasks.append((r.getrandbits(32),self.mutation_rate,
+                          mate1,mate2,wanted,self.stats is not None))
+        next_offspring = []
+        for offspring,stats,counts in self.map(_breed,tasks):
+            if stats is not None:
+                self.stats.merge(stats)
+            self.merge_cache_counts(counts)
+            next_offspring += offspring
+        return next_offspring
+
+    def replace_worst(self):
+        """
+        Steady state step: breed steady_offspring individuals and put
+        them in place of the worst ones, updating the keys in place.
+        """
+        offspring = self.breed(self.steady_offspring,exact=True)
+        offspring = offspring[:self.steady_offspring]
+        with phase('sort'):
+            replaced = worst_indices(self.keys,len(offspring))
+            for i,c in zip(replaced,offspring):
+                self.population[i] = c
+                self.keys[i] = _selection_key(c)
+            if self.best_index in replaced:
+                self.best_index = self.keys.index(min(self.keys))
+            else:
+                for i in replaced:
+                    if self.keys[i] < self.keys[self.best_index]:
+                        self.best_index = i
+
+    def improve(self):
+        """
+        Memetic stage: replace the local_search best individuals with
+        copies improved by local search.
+        """
+        indices = best_indices(self.keys,self.local_search)
+        tasks = [(r.getrandbits(32),self.population[i],
+                  self.local_search_steps,self.stats is not None)
+                 for i in indices]
+        for i,(c,stats) in zip(indices,self.map(_improve,tasks)):
+            if stats is not None:
+                self.stats.merge(stats)
+            self.population[i] = c
+            self.keys[i] = _selection_key(c)
+            if self.keys[i] < self.keys[self.best_index]:
+                self.best_index = i
+
+    def replace_similar(self):
+        """
+        Crowding step: breed a generation (or steady_offspring in
+        steady state mode) and let each offspring replace the most
+        similar of crowding randomly chosen individuals if it is not
+        worse. The best individual is never lost.
+        """
+        n = (self.size,self.steady_offspring)[bool(self.steady_state)]
+        offspring = self.breed(n,exact=True)[:n]
+        window = min(self.crowding,len(self.population))
+        with phase('replacement'):
+            for c in offspring:
+                key = _selection_key(c)
+                candidates = r.sample(xrange(len(self.population)),window)
+                i = min(candidates,
+                        key=lambda i: c.distance(self.population[i]))
+                if key <= self.keys[i]:
+                    self.population[i] = c
+                    self.keys[i] = key
+                    if key < self.keys[self.best_index]:
+                        self.best_index = i
+                    count('replaced')
+
+    def diversity(self,pairs=50):
+        """
+        Return the mean distance of sampled pairs of individuals, or
+        None if the chromosome has no signature. The pairs are drawn
+        from a generator of their own, so reporting does not change
+        the course of the run.
+        """
+        n = len(self.population)
+        if n < 2:
+            return 0.
+        sampler = r.Random(self.generation)
+        total = 0.
+        try:
+            for k in range(pairs):
+                i,j = sampler.sample(xrange(n),2)
+                total += self.population[i].distance(self.population[j])
+        except NotImplementedError:
+            return None
+        return total/pairs
+
+    def select(self,n):
+        """
+        Select n parents from the population, all at once if the
+        tournament function has a batch variant.
+        """
+        batch = getattr(self.tournament,'batch',None)
+        if batch is not None:
+            return batch(self.population,n)
+        return [self.tournament(self.population) for i in range(n)]
+
     def best(self):
         "individual with best fitness score in population."
-        return self.population[0]
+        return self.population[self.best_index]
+
+    def ranked(self,k=None):
+        "the k best individuals, best first"
+        if k is None:
+            k = len(self.population)
+        return [self.population[i] for i in best_indices(self.keys,k)]
+
+    def emigrants(self,m):
+        "copies of the m best individuals, for migration elsewhere"
+        return [c.clone() for c in self.ranked(m)]
+
+    def immigrate(self,individuals):
+        "replace the worst individuals with the given ones"
+        n = min(len(individuals),self.size)
+        if n:
+            for i,c in zip(worst_indices(self.keys,n),individuals):
+                self.population[i] = c
+            self.update_keys()
 
     def report(self):
         self.report_callback(self)
 
 
+def multiplex(runs):
+    """
+    Advance several Population.iter_run() generators round robin in
+    the current thread, yielding (index, snapshot) pairs as the runs
+    complete generations. A run closed by the caller is dropped.
+    """
+    active = list(enumerate(runs))
+    while active:
+        for i,run in active[:]:
+            try:
+                snapshot = run.next()
+            except StopIteration:
+                active.remove((i,run))
+                continue
+            if snapshot is not None:
+                yield i,snapshot
+
+
 def median(numbers):
     "Return the median of the list of numbers."
     # Sort the list and take the middle element.
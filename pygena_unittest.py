@@ -0,0 +1,498 @@
+#!/usr/bin/python
+
+import unittest
+import random
+import tempfile
+import json
+import os
+import pygena
+
+class BitChromosome(pygena.BaseChromosome):
+    """
+    A bit string chromosome for testing. The score is the amount of
+    zero bits, so the optimum is a string of ones.
+    """
+    length = 32
+    optimization = pygena.MINIMIZE
+
+    def __init__(self):
+        pygena.BaseChromosome.__init__(self)
+        self.bits = None
+        self.randomize()
+        self.repair()
+
+    def randomize(self):
+        self.bits = [random.randint(0,1) for i in range(self.length)]
+
+    def crossover(self,other):
+        c = random.randint(1,self.length-1)
+        sc = pygena.deepcopy(self)
+        oc = pygena.deepcopy(other)
+        sc.bits[c:], oc.bits[c:] = oc.bits[c:], sc.bits[c:]
+        sc.repair()
+        oc.repair()
+        return (sc,oc)
+
+    def mutate(self,mutation_rate):
+        mutated = False
+        for i in range(self.length):
+            if random.random() < mutation_rate/self.length:
+                self.bits[i] = 1-self.bits[i]
+                mutated = True
+        if mutated:
+            self.repair()
+
+    def repair(self):
+        self.evaluate()
+
+    def evaluate(self):
+        self.score = self.bits.count(0)
+
+    def local_search(self,steps):
+        for k in range(steps):
+            i = random.randint(0,self.length-1)
+            if self.bits[i]==0:
+                self.bits[i] = 1
+                self.evaluate()
+
+    def asString(self):
+        return "".join([str(b) for b in self.bits])
+
+    def fingerprint(self):
+        return tuple(self.bits)
+
+    def signature(self):
+        return frozenset(enumerate(self.bits))
+
+
+class LazyBitChromosome(BitChromosome):
+    "A BitChromosome leaving the repair of its offspring to the caller."
+    lazy_repair = True
+    repairs = 0
+
+    def crossover(self,other,repair=True,wanted=2):
+        c = random.randint(1,self.length-1)
+        sc = pygena.deepcopy(self)
+        oc = pygena.deepcopy(other)
+        sc.bits[c:], oc.bits[c:] = oc.bits[c:], sc.bits[c:]
+        sc.score = oc.score = None
+        offspring = (sc,oc)[:wanted]
+        if repair:
+            for c in offspring:
+                c.repair()
+        return offspring
+
+    def mutate(self,mutation_rate,repair=True):
+        mutated = False
+        for i in range(self.length):
+            if random.random() < mutation_rate/self.length:
+                self.bits[i] = 1-self.bits[i]
+                mutated = True
+        if mutated:
+            self.score = None
+            if repair:
+                self.repair()
+        return mutated
+
+    def repair(self):
+        LazyBitChromosome.repairs += 1
+        self.evaluate()
+
+
+class CachedBitChromosome(BitChromosome):
+    "A BitChromosome looking its score up in the fitness cache."
+
+    def repair(self):
+        key = self.fingerprint()
+        if self.cache is not None:
+            score = self.cache.get(key)
+            if score is not None:
+                self.score = score
+                return
+        self.evaluate()
+        if self.cache is not None:
+            self.cache.put(key,self.score)
+
+
+def quiet_report(population):
+    pass
+
+def run_population(**kw):
+    random.seed(1)
+    env = pygena.Population(BitChromosome, size=30, maxgenerations=15,
+                            maxplateau=None, optimum=0,
+                            tournament=pygena.roulette_tournament,
+                            report_callback=quiet_report, **kw)
+    best = env.run()
+    return best, [c.bits for c in env.population]
+
+class TestSequenceFunctions(unittest.TestCase):
+    def test_run(self):
+        best,population = run_population()
+        self.assertEqual(len(population),30)
+        self.assert_(best.score<16)
+
+    def test_workers_same_result(self):
+        """a worker pool must produce the same population as serial runs"""
+        best1,population1 = run_population()
+        best2,population2 = run_population(workers=2)
+        self.assertEqual(best1.score,best2.score)
+        self.assertEqual(population1,population2)
+
+    def test_cache_lru(self):
+        cache = pygena.FitnessCache(2)
+        cache.put('a',1)
+        cache.put('b',2)
+        self.assertEqual(cache.get('a'),1)
+        cache.put('c',3)
+        # b was the least recently used
+        self.assertEqual(cache.get('b'),None)
+        self.assertEqual(cache.get('c'),3)
+        self.assertEqual(len(cache),2)
+        self.assertEqual((cache.hits,cache.misses),(2,1))
+
+    def test_cache_counts_workers(self):
+        """the lookups made in worker processes are counted"""
+        lookups = []
+        for workers in (None,2):
+            random.seed(1)
+            env = pygena.Population(CachedBitChromosome, size=20,
+                                    maxgenerations=3, maxplateau=None,
+                                    cache_size=100, workers=workers,
+                                    report_callback=quiet_report)
+            env.run()
+            env.close()
+            lookups.append(env.cache.hits+env.cache.misses)
+        self.assert_(lookups[0]>0)
+        self.assertEqual(lookups[0],lookups[1])
+
+    def test_reject_duplicates(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=30, maxplateau=None,
+                                tournament=pygena.roulette_tournament,
+                                report_callback=quiet_report,
+                                reject_duplicates=True)
+        env.step()
+        keys = [c.fingerprint() for c in env.population]
+        if env.rejected < env.size:
+            self.assertEqual(len(set(keys)),len(keys))
+
+    def test_roulette_selection(self):
+        random.seed(1)
+        population = [BitChromosome() for i in range(10)]
+        for i,c in enumerate(population):
+            c.score = (1,100)[i>0]
+        parents = pygena.roulette_selection(population,1000)
+        self.assertEqual(len(parents),1000)
+        # the weight of the first one is 100 times the others'
+        n = len([p for p in parents if p is population[0]])
+        self.assert_(800<n<1000)
+
+    def test_simple_selection(self):
+        random.seed(1)
+        population = [BitChromosome() for i in range(10)]
+        for i,c in enumerate(population):
+            c.score = i
+        parents = pygena.simple_selection(population,100,size=10,
+                                          choosebest=1.0)
+        self.assertEqual(parents,[population[0]]*100)
+        parents = pygena.simple_selection(population,100,size=10,
+                                          choosebest=0.0)
+        self.assert_(population[0] not in parents)
+
+    def test_simple_tournament(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=30,
+                                report_callback=quiet_report)
+        env.step()
+        self.assertEqual(len(env.population),30)
+
+    def test_best_indices(self):
+        keys = [5,3,9,1,7,3]
+        self.assertEqual(pygena.best_indices(keys,2),[3,1])
+        self.assertEqual(sorted(pygena.best_indices(keys,3)),[1,3,5])
+        self.assertEqual(pygena.worst_indices(keys,2),[2,4])
+        self.assertEqual(len(pygena.best_indices(keys,10)),6)
+
+    def test_best_unsorted(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=30,
+                                report_callback=quiet_report)
+        env.step()
+        scores = [c.score for c in env.population]
+        self.assertEqual(env.best().score,min(scores))
+        ranked = [c.score for c in env.ranked()]
+        self.assertEqual(ranked,sorted(scores))
+
+    def test_immigrate(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=10,
+                                report_callback=quiet_report)
+        worst = env.ranked()[-1]
+        champion = BitChromosome()
+        champion.bits = [1]*champion.length
+        champion.evaluate()
+        env.immigrate([champion])
+        self.assert_(env.best() is champion)
+        self.assert_(worst not in env.population)
+
+    def test_stats_phases(self):
+        stats = pygena.Stats()
+        pygena.activate(stats)
+        with pygena.phase('outer'):
+            with pygena.phase('inner'):
+                pygena.count('events',2)
+            pygena.count('events')
+        pygena.activate(None)
+        pygena.count('events')
+        self.assertEqual(stats.counters,{'events': 3})
+        self.assertEqual(sorted(stats.times.keys()),['inner','outer'])
+
+    def test_instrument(self):
+        records = []
+        fd,path = tempfile.mkstemp()
+        os.close(fd)
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=10, maxgenerations=3,
+                                maxplateau=None,
+                                report_callback=quiet_report,
+                                instrument=records.append,
+                                stats_file=path)
+        env.run()
+        lines = [json.loads(l) for l in open(path)]
+        os.remove(path)
+        self.assertEqual(len(records),3)
+        self.assertEqual([l['generation'] for l in lines],[0,1,2])
+        for phase in ['selection','crossover','mutation','sort']:
+            self.assert_(phase in records[0]['times'])
+        self.assert_(records[0]['counters']['deepcopy']>0)
+
+    def test_checkpoint_resume(self):
+        """a resumed run continues exactly like an uninterrupted one"""
+        fd,path = tempfile.mkstemp()
+        os.close(fd)
+        kw = dict(size=20, maxplateau=None, report_callback=quiet_report)
+        random.seed(1)
+        env = pygena.Population(BitChromosome, maxgenerations=6, **kw)
+        env.run()
+        expected = [c.bits for c in env.population]
+
+        random.seed(1)
+        env = pygena.Population(BitChromosome, maxgenerations=3,
+                                checkpoint=path, **kw)
+        env.run()
+        random.seed(2)
+        env = pygena.Population.resume(BitChromosome, path,
+                                       maxgenerations=6, **kw)
+        os.remove(path)
+        self.assertEqual(env.generation,3)
+        env.run()
+        self.assertEqual([c.bits for c in env.population],expected)
+
+    def test_steady_state(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=50,
+                                maxplateau=None,
+                                report_callback=quiet_report,
+                                steady_state=True, steady_offspring=3)
+        first = set(map(id,env.population))
+        scores = []
+        for i in range(50):
+            env.step()
+            scores.append(env.best().score)
+            self.assertEqual(len(env.population),20)
+            self.assertEqual(env.keys,[c.score for c in env.population])
+            self.assertEqual(env.best().score,min(env.keys))
+        # replacing the worst never loses the best
+        self.assertEqual(scores,sorted(scores,reverse=True))
+        self.assertEqual(env.generation,50)
+        kept = len([c for c in env.population if id(c) in first])
+        self.assert_(kept<20)
+
+    def test_report_interval(self):
+        reported = []
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=12,
+                                maxplateau=None, report_interval=5,
+                                report_callback=lambda env:
+                                    reported.append(env.generation))
+        env.run()
+        # every report_interval generations, and at the end
+        self.assertEqual(reported,[0,5,10,12])
+
+    def test_time_budget(self):
+        random.seed(1)
+        improvements = []
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=1000,
+                                maxplateau=None,
+                                report_callback=quiet_report,
+                                time_budget=0.,
+                                on_improvement=improvements.append)
+        best = env.run()
+        self.assertEqual(env.generation,0)
+        self.assert_(best is env.best())
+        self.assertEqual(improvements,[best])
+
+    def test_on_improvement(self):
+        random.seed(1)
+        improvements = []
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=20,
+                                maxplateau=None,
+                                report_callback=quiet_report,
+                                on_improvement=improvements.append)
+        best = env.run()
+        scores = [c.score for c in improvements]
+        self.assert_(len(scores)>1)
+        self.assertEqual(scores,sorted(set(scores),reverse=True))
+        self.assertEqual(scores[-1],best.score)
+
+    def test_iter_run(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=5,
+                                maxplateau=None,
+                                report_callback=quiet_report)
+        snapshots = list(env.iter_run())
+        self.assertEqual([s.generation for s in snapshots],[1,2,3,4,5])
+        self.assertEqual(snapshots[-1].best_score,env.best().score)
+
+    def test_iter_run_batches(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=2,
+                                maxplateau=None, elitism=False,
+                                crossover_rate=0.,
+                                report_callback=quiet_report)
+        steps = list(env.iter_run(batch_size=5))
+        # four batches make a generation
+        self.assertEqual(steps,[None]*3+[steps[3]]+[None]*3+[steps[7]])
+        self.assertEqual(steps[7].generation,2)
+
+    def test_cancel(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=50,
+                                maxplateau=None, workers=2,
+                                report_callback=quiet_report)
+        run = env.iter_run(batch_size=5)
+        run.next()
+        run.close()
+        self.assertEqual(env.generation,0)
+        self.assertEqual(env.pool,None)
+
+    def test_multiplex(self):
+        random.seed(1)
+        envs = [pygena.Population(BitChromosome, size=10, maxgenerations=n,
+                                  maxplateau=None,
+                                  report_callback=quiet_report)
+                for n in (2,4)]
+        runs = [env.iter_run(batch_size=3) for env in envs]
+        order = [(i,s.generation) for i,s in pygena.multiplex(runs)]
+        self.assertEqual(order,[(0,1),(1,1),(0,2),(1,2),(1,3),(1,4)])
+
+    def test_multiplex_caches(self):
+        """multiplexed populations of one class keep their own caches"""
+        random.seed(1)
+        envs = [pygena.Population(CachedBitChromosome, size=10,
+                                  maxgenerations=4, maxplateau=None,
+                                  cache_size=size,
+                                  report_callback=quiet_report)
+                for size in (100,50,None)]
+        lookups = [env.cache.hits+env.cache.misses for env in envs[:2]]
+        runs = [env.iter_run(batch_size=3) for env in envs]
+        for i,snapshot in pygena.multiplex(runs):
+            pass
+        # the breeding looked up the caches too
+        for env,before in zip(envs,lookups):
+            self.assert_(env.cache.hits+env.cache.misses>before)
+            self.assert_(len(env.cache)<=env.cache.size)
+        self.assertEqual(CachedBitChromosome.cache,None)
+
+    def test_distance(self):
+        a = BitChromosome()
+        b = BitChromosome()
+        a.bits = [0]*32
+        b.bits = [0]*16+[1]*16
+        self.assertEqual(a.distance(a),0.)
+        # 16 common features of 48
+        self.assertAlmostEqual(a.distance(b),2./3)
+        self.assertEqual(a.distance(b),b.distance(a))
+
+    def test_crowding(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=20,
+                                maxplateau=None,
+                                report_callback=quiet_report,
+                                crowding=4)
+        scores = []
+        for i in range(20):
+            env.step()
+            scores.append(env.best().score)
+            self.assertEqual(len(env.population),20)
+            self.assertEqual(env.keys,[c.score for c in env.population])
+            self.assertEqual(env.best().score,min(env.keys))
+        self.assertEqual(scores,sorted(scores,reverse=True))
+        self.assert_(scores[-1]<scores[0])
+
+    def test_diversity(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20,
+                                report_callback=quiet_report)
+        state = random.getstate()
+        diversity = env.diversity()
+        self.assertEqual(random.getstate(),state)
+        self.assertEqual(env.diversity(),diversity)
+        self.assert_(0.<diversity<1.)
+        for c in env.population:
+            c.bits = [1]*c.length
+        self.assertEqual(env.diversity(),0.)
+
+    def test_local_search(self):
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=5,
+                                maxplateau=None,
+                                report_callback=quiet_report,
+                                local_search=2, local_search_steps=8)
+        first = env.best().score
+        env.step()
+        self.assertEqual(env.keys,[c.score for c in env.population])
+        self.assertEqual(env.best().score,min(env.keys))
+        self.assert_(env.best().score<first)
+
+    def test_local_search_workers(self):
+        kw = dict(local_search=3, local_search_steps=5)
+        best1,population1 = run_population(**kw)
+        best2,population2 = run_population(workers=2,**kw)
+        self.assertEqual(population1,population2)
+
+    def test_breed_count(self):
+        """breeding gives exactly the offspring asked for"""
+        random.seed(1)
+        env = pygena.Population(BitChromosome, size=20, maxgenerations=5,
+                                maxplateau=None, crossover_rate=1.0,
+                                report_callback=quiet_report)
+        for n in range(1,8):
+            self.assertEqual(len(env.breed(n)),n)
+
+    def test_lazy_repair(self):
+        """lazy offspring are repaired once, and only if they are kept"""
+        random.seed(1)
+        env = pygena.Population(LazyBitChromosome, size=20,
+                                maxgenerations=5, maxplateau=None,
+                                crossover_rate=1.0, mutation_rate=4.0,
+                                report_callback=quiet_report)
+        LazyBitChromosome.repairs = 0
+        offspring = env.breed(5)
+        self.assertEqual(len(offspring),5)
+        self.assertEqual(LazyBitChromosome.repairs,5)
+        for c in offspring:
+            self.assertEqual(c.score,c.bits.count(0))
+        # copies are only repaired when mutated
+        env.crossover_rate = 0.0
+        env.mutation_rate = 0.0
+        LazyBitChromosome.repairs = 0
+        offspring = env.breed(5)
+        self.assertEqual(LazyBitChromosome.repairs,0)
+        for c in offspring:
+            self.assertEqual(c.score,c.bits.count(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,8 @@ import random
 
 
 class ItemType(object):
+    __slots__ = ('w','l','rotatable','description')
+
     def __init__(self, width, length, description="", rotatable=False):
         self.w = width
         self.l = length
@@ -19,23 +21,53 @@ class ItemType(object):
     def __repr__(self):
         return "ItemType(%d,%d,'%s')" % (self.w,self.l,self.description)
 
+    def __reduce__(self):
+        return (ItemType,(self.w,self.l,self.description,self.rotatable))
+
 
 class Item(object):
+    # the size is kept in its rotated orientation rather than looked up
+    # from the type on every access
+    __slots__ = ('type','rotated','location','x','y','id','w','l')
+
     def __init__(self,type_,rotated=False):
         self.type = type_
         self.rotated = rotated
+        if rotated:
+            self.w,self.l = type_.l,type_.w
+        else:
+            self.w,self.l = type_.w,type_.l
         # location within the region tree
         self.location = None
         self.x = None
         self.y = None
-	# create a unique identifier for later matching of duplicates
-	self.id = id(self)
+        # create a unique identifier for later matching of duplicates
+        self.id = id(self)
+
+    def __getstate__(self):
+        return (self.type,self.rotated,self.location,self.x,self.y,self.id,
+                self.w,self.l)
+
+    def __setstate__(self,state):
+        self.type,self.rotated,self.location,self.x,self.y,self.id,\
+            self.w,self.l = state
 
     def rotate(self):
         self.rotated = not self.rotated
-
-    l = property(lambda self: (self.type.l,self.type.w)[self.rotated])
-    w = property(lambda self: (self.type.w,self.type.l)[self.rotated])
+        self.w,self.l = self.l,self.w
+
+    def clone(self):
+        "copy the item, sharing its type"
+        twin = Item.__new__(Item)
+        twin.type = self.type
+        twin.rotated = self.rotated
+        twin.location = None
+        twin.x = self.x
+        twin.y = self.y
+        twin.id = self.id
+        twin.w = self.w
+        twin.l = self.l
+        return twin
 
     def area(self):
         return self.w*self.l
@@ -47,17 +79,107 @@ class Item(object):
         return "Item (%d,%d,%s) of type %r" % (self.w,self.l,('F','T')[self.rotated],self.type)
 
     
+class RegionIndex(object):
+    """
+    The placed items of a region tree, kept up to date by split,
+    drop_item and clear_region so that the root answers get_items,
+    num_items and covered_area without walking the tree.
+
+    root         the root region of the tree
+    locations    item -> the regions holding it (more than one only
+                 while duplicates are being placed and removed)
+    count        the amount of placed items
+    area         the area covered by the placed items
+
+    Rotating an item keeps its area, so transpose leaves the index as
+    is.
+    """
+    __slots__ = ('root','locations','count','area')
+
+    def __init__(self,root):
+        self.root = root
+        self.locations = {}
+        self.count = 0
+        self.area = 0
+
+    def __getstate__(self):
+        return self.root,self.locations,self.count,self.area
+
+    def __setstate__(self,state):
+        self.root,self.locations,self.count,self.area = state
+
+    def add(self,item,region):
+        "Record the item as placed in region."
+        self.locations.setdefault(item,[]).append(region)
+        item.location = region
+        self.count += 1
+        self.area += item.w*item.l
+
+    def remove(self,item,region):
+        "Record the item as removed from region."
+        regions = self.locations[item]
+        regions.remove(region)
+        if not regions:
+            del self.locations[item]
+        elif item.location is region:
+            item.location = regions[-1]
+        self.count -= 1
+        self.area -= item.w*item.l
+
+
 class Region(object):
     """
     Region is any rectangular area on a plane.
     A Region may contain an item, in which case the remaining area is divided
     into two subregions.
+
+    All the regions of a tree share its RegionIndex; a region created
+    without one starts a new tree.
     """
-    def __init__(self,w,l):
+    # Block and Segment add no slots, so that a region can change its
+    # class in place (see transpose)
+    __slots__ = ('w','l','item','regions','tree')
+
+    def __init__(self,w,l,tree=None):
         self.w = w
         self.l = l
         self.item = None
         self.regions = []
+        if tree is None:
+            tree = RegionIndex(self)
+        self.tree = tree
+
+    def __getstate__(self):
+        return self.w,self.l,self.item,self.regions,self.tree
+
+    def __setstate__(self,state):
+        self.w,self.l,self.item,self.regions,self.tree = state
+
+    def swap(self,other):
+        "Exchange the contents and the classes of the regions."
+        self._unindex()
+        other._unindex()
+        self.w,self.l,self.item,self.regions,self.__class__, \
+            other.w,other.l,other.item,other.regions,other.__class__ = \
+            other.w,other.l,other.item,other.regions,other.__class__, \
+            self.w,self.l,self.item,self.regions,self.__class__
+        self._index(self.tree)
+        other._index(other.tree)
+
+    def _index(self,tree):
+        "Move the subtree to tree and record its items there."
+        self.tree = tree
+        if self.item:
+            tree.add(self.item,self)
+        for r in self.regions:
+            r._index(tree)
+
+    def _unindex(self):
+        "Remove the items of the subtree from the index."
+        if self.item:
+            self.tree.remove(self.item,self)
+        for r in self.regions:
+            r._unindex()
 
     def _walk_regions(self,d):
         if self.item:
@@ -68,7 +190,38 @@ class Region(object):
         for r in self.regions:
             r._walk_regions(d)
         
+    def clone(self,memo=None,graft=None,tree=None):
+        """
+        Copy the region tree, sharing the item types.
+
+        memo maps the ids of the original items to their copies, so that
+        an item placed twice is copied only once. graft is an optional
+        (region, other) pair: other is copied in place of region. The
+        copy goes to the RegionIndex tree, or starts a new tree.
+        """
+        if memo is None:
+            memo = {}
+        if graft is not None and self is graft[0]:
+            return graft[1].clone(memo,None,tree)
+        twin = self.__class__.__new__(self.__class__)
+        if tree is None:
+            tree = RegionIndex(twin)
+        twin.tree = tree
+        twin.w = self.w
+        twin.l = self.l
+        twin.item = self.item
+        if self.item:
+            item = memo.get(id(self.item))
+            if item is None:
+                item = memo[id(self.item)] = self.item.clone()
+            twin.item = item
+            tree.add(item,twin)
+        twin.regions = [r.clone(memo,graft,tree) for r in self.regions]
+        return twin
+
     def get_items(self):
+        if self is self.tree.root:
+            return self.tree.locations.keys()
         d = {}
         self._walk_regions(d)
         return d.keys()
@@ -85,6 +238,8 @@ class Region(object):
         return self.l * self.w
 
     def num_items(self):
+        if self is self.tree.root:
+            return self.tree.count
         n = 0
         if self.item:
             n += 1
@@ -94,6 +249,8 @@ class Region(object):
 
     
     def covered_area(self):
+        if self is self.tree.root:
+            return self.tree.area
         A = 0
         if self.item:
             A += self.item.w * self.item.l
@@ -134,6 +291,7 @@ class Region(object):
 	return items
 
     def clear_region(self):
+        self._unindex()
 	self.item = None
 	self.regions = []
 
@@ -157,10 +315,12 @@ class Region(object):
 	#	 duplicates and get a list of placed items
 
 	nr = self.repair(w,l)
+        pygena.count('repair_drops',nr)
         self.expand(w,l)
 	unplaced = self.populate(items[:],item_min_dim)
         assert(len(unplaced)==0) # every piece should fit now
-	self.remove_duplicates({})
+	nd = self.remove_duplicates({})
+        pygena.count('repair_duplicates',nd)
         nr = self.repair(w,l)
 
     def remove_duplicates(self,seen):
@@ -191,6 +351,7 @@ class Block(Region):
     | I | A |
     +---+---+
     """
+    __slots__ = ()
     
     def __repr__(self):
         return "Block(%d,%d)" % (self.w,self.l)
@@ -221,10 +382,10 @@ class Block(Region):
         lB = self.l
         wB = self.w-item.w
 
-        item.location = self
+        self.tree.add(item,self)
         self.item = item
 
-	self.regions = [Block(wA,lA),Block(wB,lB)]
+	self.regions = [Block(wA,lA,self.tree),Block(wB,lB,self.tree)]
 
     def transpose(self):
         """
@@ -243,6 +404,7 @@ class Block(Region):
 	Remove the item from the current region.
 	Subregion A is grown to occupy the freed space.
 	"""
+        self.tree.remove(self.item,self)
 	self.item = None
 	self.regions[0].l = self.l
 
@@ -348,6 +510,7 @@ class Segment(Region):
     | I |   |
     +---+---+
     """
+    __slots__ = ()
 
     def __repr__(self):
         return "Segment(%d,%d)" % (self.w,self.l)
@@ -378,10 +541,10 @@ class Segment(Region):
         lB = self.l-item.l
         wB = self.w
 
-        item.location = self
+        self.tree.add(item,self)
         self.item = item
         
-        self.regions = [Block(wA,lA),Segment(wB,lB)]
+        self.regions = [Block(wA,lA,self.tree),Segment(wB,lB,self.tree)]
 
     def transpose(self):
         """
@@ -401,6 +564,7 @@ class Segment(Region):
 	Remove the item from the current region.
 	Subregion A is grown to occupy the freed space.
 	"""
+        self.tree.remove(self.item,self)
 	self.item = None
 	self.regions[0].w = self.w
 
@@ -427,8 +591,8 @@ class Segment(Region):
 
             # wrap dead-ends to segments
             if isinstance(srB,Block):
-                s = Segment(srB.w,srB.l)
-                s.regions = [srB, Segment(0,0)]
+                s = Segment(srB.w,srB.l,self.tree)
+                s.regions = [srB, Segment(0,0,self.tree)]
                 srB = self.regions[1] = s
                 
             if self.item:
@@ -509,7 +673,8 @@ class RegionChromosome(pygena.BaseChromosome):
     optimization = pygena.MINIMIZE
     def __init__(self):
         pygena.BaseChromosome.__init__(self)
-        self.items = copy.deepcopy(RegionChromosome.items)
+        # own copies of the items, which are placed as such
+        self.items = [item.clone() for item in RegionChromosome.items]
         self.region = None
         self.randomize()
         self.repair()
@@ -522,45 +687,44 @@ class RegionChromosome(pygena.BaseChromosome):
         
     def randomize(self):
         self.region = Segment(self.W,self.L)
-        s = Segment(self.W,self.L)
+        s = Segment(self.W,self.L,self.region.tree)
         self._random_rotate_items()
         # uncomment this to test the GA performance more efficiently
         #random.shuffle(self.items)
         s.populate(self.items[:])
-        self.region.regions = [Segment(0,0),s]
+        self.region.regions = [Segment(0,0,self.region.tree),s]
 
     def crossover(self,other):
         """
         perform crossover operation on two region trees.
-        return two copies after the operation without repairing them.
-        """
+        return two repaired copies after the operation.
 
-        valid = False
+        The regions of two random items are exchanged. A draw that
+        would make a Block the root is rejected before anything is
+        copied, and each copy takes the other's region directly.
+        """
 
         self.items = self.region.get_items()
         other.items = other.region.get_items()
-        while not valid:
+        while True:
         
             # get crossover points
             c1 = random.randint(0,len(self.items)-1)
             c2 = random.randint(0,len(other.items)-1)
-        
-            # crossover needs to be performed on copied objects
-            sc = copy.deepcopy(self)
-            oc = copy.deepcopy(other)
 
-            reg_1 = sc.items[c1].location
-            reg_2 = oc.items[c2].location
-        
-            # swap the object contents
-            reg_2.__dict__, reg_2.__class__, \
-                reg_1.__dict__, reg_1.__class__ = \
-                reg_1.__dict__, reg_1.__class__, \
-                reg_2.__dict__, reg_2.__class__
+            reg_1 = self.items[c1].location
+            reg_2 = other.items[c2].location
+
+            # the roots are Segments and must stay so
+            if not (reg_1 is self.region and isinstance(reg_2,Block)) \
+                    and not (reg_2 is other.region
+                             and isinstance(reg_1,Block)):
+                break
+            pygena.count('crossover_rejected')
 
-            if not isinstance(sc.region,Block) \
-                    and not isinstance(oc.region,Block):
-                valid = True
+        # copy the parents with the regions exchanged
+        sc = self.clone((reg_1,reg_2))
+        oc = other.clone((reg_2,reg_1))
 
         # repair the offspring
         sc.repair()
@@ -585,10 +749,35 @@ class RegionChromosome(pygena.BaseChromosome):
         if mutated:
             self.repair()
 
+    @classmethod
+    def class_state(cls):
+        return dict(items=cls.items,W=cls.W,L=cls.L,
+                    item_min_dim=cls.item_min_dim)
+
+    @classmethod
+    def set_class_state(cls,state):
+        for name,value in state.items():
+            setattr(cls,name,value)
+
+    def clone(self,graft=None):
+        """
+        copy the region tree and the items within, with the optional
+        graft of Region.clone
+        """
+        pygena.count('clone')
+        memo = {}
+        twin = self.__class__.__new__(self.__class__)
+        twin.__dict__.update(self.__dict__)
+        twin.region = self.region.clone(memo,graft)
+        twin.items = [memo.get(id(i)) or i.clone() for i in self.items]
+        return twin
+
     def repair(self):
-        self.region.fix_layout(self.items,self.W,self.L,self.item_min_dim)
+        with pygena.phase('repair'):
+            self.region.fix_layout(self.items,self.W,self.L,self.item_min_dim)
         assert(self.region.num_items()==len(self.items)) # must have all items in the layout
-        self.evaluate()
+        with pygena.phase('evaluation'):
+            self.evaluate()
 
     def evaluate(self):
         self.score = self.region.l/self.region.fillrate()
@@ -597,7 +786,16 @@ class RegionChromosome(pygena.BaseChromosome):
         return 'items=%d, w=%d, l=%d, fillrate=%f' % (self.region.num_items(), self.region.w, self.region.l, self.region.fillrate())
         
 
-def optimize(items,W,verbose=False):
+def optimize(items,W,verbose=False,workers=None,time_budget=None,
+             progress=None,stop=None):
+    """
+    Lay out the items on a strip of width W and return the strip length
+    and the placed items.
+
+    The run stops after time_budget seconds, if given, or when stop()
+    returns true. progress is called with the length, the fill rate and
+    copies of the items of each improved layout.
+    """
     items.sort(key=lambda x: x.area(), reverse=True)
     RegionChromosome.items = items
     RegionChromosome.W = W
@@ -607,15 +805,28 @@ def optimize(items,W,verbose=False):
     RegionChromosome.item_min_dim = \
         min([i.w for i in items]+[i.l for i in items])
     
+    on_improvement = None
+    if progress is not None:
+        def on_improvement(best):
+            twin = best.clone()
+            twin.region.calculate_item_coordinates()
+            progress(twin.region.l,twin.region.fillrate(),
+                     twin.region.get_items())
+
     env = pygena.Population(RegionChromosome, maxgenerations=50, optimum=0,
                             tournament=pygena.roulette_tournament,
                             size=100,
-                            crossover_rate=0.7, mutation_rate=0.3)
+                            crossover_rate=0.7, mutation_rate=0.3,
+                            workers=workers,time_budget=time_budget,
+                            on_improvement=on_improvement,stop=stop,
+                            report_callback=(pygena.quiet_report,
+                                             pygena.default_report)[verbose])
     best = env.run()
     best.region.calculate_item_coordinates()
     output_items = best.region.get_items()
 
-    print "output_items:", len(output_items)
+    if verbose:
+        print "output_items:", len(output_items)
 
     #best.region.dump()
     
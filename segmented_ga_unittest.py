@@ -1,6 +1,8 @@
 #!/usr/bin/python
 
 import unittest
+import random
+import pickle
 from segmented_ga import *
 
 t1 = ItemType(100,1500)
@@ -15,6 +17,40 @@ i4 = Item(t3)
 
 items = [i1,i2,i3,i4]
 
+def layout(region):
+    "The region tree as nested tuples, for comparisons."
+    item = None
+    if region.item:
+        item = (region.item.id,region.item.rotated)
+    return (region.__class__.__name__,region.w,region.l,item,
+            tuple([layout(r) for r in region.regions]))
+
+def placements(region):
+    "The (item, region) pairs of the tree, by walking it."
+    pairs = []
+    if region.item:
+        pairs.append((region.item,region))
+    for r in region.regions:
+        pairs += placements(r)
+    return pairs
+
+def swap_crossover(a,b):
+    "The crossover by copying the parents and swapping the regions."
+    a.items = a.region.get_items()
+    b.items = b.region.get_items()
+    while True:
+        c1 = random.randint(0,len(a.items)-1)
+        c2 = random.randint(0,len(b.items)-1)
+        sc = a.clone()
+        oc = b.clone()
+        sc.items[c1].location.swap(oc.items[c2].location)
+        if not isinstance(sc.region,Block) \
+                and not isinstance(oc.region,Block):
+            break
+    sc.repair()
+    oc.repair()
+    return (sc,oc)
+
 class TestSequenceFunctions(unittest.TestCase):
     def test_segment_split(self):
         s = Segment(2000,2000)
@@ -115,6 +151,116 @@ class TestSequenceFunctions(unittest.TestCase):
         self.assert_(co1.region.covered_area()>0)
         self.assert_(co2.region.covered_area()>0)
 
+    def test_crossover_graft(self):
+        """the grafted copies are the swapped copies"""
+        random.seed(3)
+        types = [ItemType(w,l) for w,l in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        RegionChromosome.items = [Item(t) for t in types for k in range(4)]
+        RegionChromosome.W = 800
+        RegionChromosome.L = 100000
+        population = [RegionChromosome() for i in range(6)]
+        # an item at the root rules out swaps with Blocks
+        rooted = population[0]
+        rooted.region = Segment(rooted.W,rooted.L)
+        rooted.region.populate(rooted.items[:])
+        rooted.repair()
+        self.assert_(rooted.region.item)
+        for k in range(30):
+            a,b = random.sample(population,2)
+            if k%3==0:
+                a = rooted
+            before = layout(a.region),layout(b.region)
+            state = random.getstate()
+            children = a.crossover(b)
+            random.setstate(state)
+            expected = swap_crossover(a,b)
+            self.assertEqual([layout(c.region) for c in children],
+                             [layout(c.region) for c in expected])
+            self.assertEqual((layout(a.region),layout(b.region)),before)
+            for c in children:
+                self.failIf(isinstance(c.region,Block))
+                self.assertEqual(c.region.num_items(),len(c.items))
+            population[random.randint(0,5)] = children[0]
+
+    def test_region_index(self):
+        """the maintained index matches a walk of the tree"""
+        def check(region):
+            pairs = placements(region)
+            self.assertEqual(region.num_items(),len(pairs))
+            self.assertEqual(region.covered_area(),
+                             sum([i.area() for i,r in pairs]))
+            self.assertEqual(sorted(map(id,region.get_items())),
+                             sorted(set([id(i) for i,r in pairs])))
+            for i,r in pairs:
+                self.assert_(r.tree is region.tree)
+                self.assert_(i.location.item is i)
+        random.seed(4)
+        types = [ItemType(w,l) for w,l in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        RegionChromosome.items = [Item(t) for t in types for k in range(4)]
+        RegionChromosome.W = 800
+        RegionChromosome.L = 100000
+        population = [RegionChromosome() for i in range(6)]
+        for k in range(30):
+            a,b = random.sample(population,2)
+            c,d = a.crossover(b)
+            check(c.region)
+            c.mutate(3.)
+            check(c.region)
+            c.repair()
+            check(c.region)
+            population[random.randint(0,5)] = c
+        c = pickle.loads(pickle.dumps(c,2))
+        check(c.region)
+        c.mutate(3.)
+        check(c.region)
+        # swapping regions moves their items between the trees
+        x = population[0].region.regions[1]
+        y = population[1].region.regions[1]
+        x.swap(y)
+        check(population[0].region)
+        check(population[1].region)
+        population[0].region.regions[1].clear_region()
+        check(population[0].region)
+
+    def test_chromosome_clone(self):
+        RegionChromosome.items = items
+        RegionChromosome.W = 2000
+        RegionChromosome.L = 10000
+
+        rc = RegionChromosome()
+        rc.items = rc.region.get_items()
+        twin = rc.clone()
+
+        self.assertEqual(len(twin.items),len(rc.items))
+        for a,b in zip(rc.items,twin.items):
+            self.assert_(a is not b)
+            self.assert_(a.type is b.type)
+            self.assertEqual(a.id,b.id)
+            self.assert_(b.location.item is b)
+        self.assertEqual(twin.region.covered_area(),rc.region.covered_area())
+
+    def test_region_swap(self):
+        b = Block(100,200)
+        b.split(Item(t2))
+        s = Segment(300,400)
+        b.swap(s)
+        self.assert_(isinstance(b,Segment))
+        self.assert_(isinstance(s,Block))
+        self.assertEqual((b.w,b.l,b.item,b.regions),(300,400,None,[]))
+        self.assertEqual((s.w,s.l),(100,200))
+        self.assertEqual(len(s.regions),2)
+
+    def test_item_rotate(self):
+        item = Item(t2)
+        w,l = item.w,item.l
+        item.rotate()
+        self.assertEqual((item.w,item.l),(l,w))
+        self.assertEqual((Item(t2,rotated=True).w,Item(t2,rotated=True).l),
+                         (l,w))
+        self.failIf(hasattr(item,'__dict__'))
+
         
 if __name__ == '__main__':
     unittest.main()
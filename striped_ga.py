@@ -7,9 +7,11 @@ import math
 import itertools
 import weakref
 import pygena
+import islands as island_model
 import copy
 import random
 import pickle
+import bisect
 
 def indent(s, numSpaces):
     s = s.split("\n")
@@ -48,10 +50,24 @@ class ItemType(object):
         memo[id(self)] = self
         return self
 
+    # unpickle through the constructor, so that types sent to and from
+    # worker processes get interned like the original ones
+    def __reduce__(self):
+        return (ItemType,(self.w,self.h,self.text,self.rotatable))
+
 class Item(object):
+    # a layout has an object per part, so the items have no __dict__;
+    # the size is kept in its rotated orientation rather than looked up
+    # from the type on every access
+    __slots__ = ('type','rotated','id','x','y','w','h','parent','owner')
+
     def __init__(self,type_,rotated=False,x=None,y=None,id_=None):
         self.type = type_
         self.rotated = rotated
+        if rotated:
+            self.w,self.h = type_.h,type_.w
+        else:
+            self.w,self.h = type_.w,type_.h
         # create a unique identifier for later matching of duplicates
         if id_ is not None:
             self.id = id_
@@ -59,6 +75,17 @@ class Item(object):
             self.id = id(self)
         self.x = x
         self.y = y
+        # the strip containing the item, set by the strip
+        self.parent = None
+        # the tree the item belongs to, see StripChromosome
+        self.owner = None
+
+    def __getstate__(self):
+        return self.type,self.rotated,self.id,self.x,self.y
+
+    def __setstate__(self,state):
+        type_,rotated,id_,x,y = state
+        self.__init__(type_,rotated,x,y,id_)
 
     def __str__(self):
         return "I(id%d,w%s,h%s,x%s,y%s,r%s,t%s,txt'%s')" % \
@@ -71,9 +98,27 @@ class Item(object):
 
     def rotate(self):
         self.rotated = not self.rotated
+        self.w,self.h = self.h,self.w
+        if self.parent is not None:
+            self.parent.invalidate()
+
+    def clone(self,owner=None):
+        "copy the item, sharing its type, for the tree of owner"
+        twin = Item.__new__(Item)
+        twin.type = self.type
+        twin.rotated = self.rotated
+        twin.id = self.id
+        twin.x = self.x
+        twin.y = self.y
+        twin.w = self.w
+        twin.h = self.h
+        twin.parent = None
+        twin.owner = owner
+        return twin
+
+    # an item has no elements to share
+    copy = clone
 
-    w = property(lambda self: (self.type.w,self.type.h)[self.rotated])
-    h = property(lambda self: (self.type.h,self.type.w)[self.rotated])
     text = property(lambda self: self.type.text)
     rotatable = property(lambda self: self.type.rotatable)
 
@@ -114,6 +159,9 @@ class Strip(list):
     min_item_height = 0
     min_item_width = 0
 
+    __slots__ = ('w','h','W','H','x','y','parent','owner','dirty',
+                 'space_dirty','covered_cache','elements_cache','fill_cache')
+
     def __init__(self,w=None,h=None,W=None,H=None,x=None,y=None,list_=[]):
         super(Strip,self).__init__()
         self.w = w
@@ -122,8 +170,40 @@ class Strip(list):
         self.H = H
         self.x = x
         self.y = y
+        # The list mutators below maintain the parent pointers of the
+        # elements and mark the changed strips and their ancestors
+        # dirty, so that the dimension updates can skip the unchanged
+        # subtrees. A subtree may be shared by several trees (see
+        # StripChromosome); its parent pointers are those of the tree
+        # that changed it last, see reparent().
+        self.parent = None
+        # the tree the strip belongs to; the strip is only changed in
+        # place by the methods running on a strip of the same owner,
+        # which copy the elements of other owners before changing them
+        self.owner = None
+        # the sizes and coordinates of the subtree need updating
+        self.dirty = True
+        # the space available for the elements needs updating
+        self.space_dirty = True
+        # the cached covered_area(), element_scores() and fill_score(),
+        # None when stale; a stale cache implies stale caches in the
+        # ancestors
+        self.covered_cache = None
+        self.elements_cache = None
+        self.fill_cache = None
         self += list_
 
+    # rebuild through the constructor, which sets the parent pointers
+    def __reduce__(self):
+        return (type(self),
+                (self.w,self.h,self.W,self.H,self.x,self.y,list(self)),
+                (self.dirty,self.space_dirty,self.covered_cache,
+                 self.elements_cache,self.fill_cache))
+
+    def __setstate__(self,state):
+        self.dirty,self.space_dirty,self.covered_cache,\
+            self.elements_cache,self.fill_cache = state
+
     def __repr__(self):
         r = [repr(p) for p in self]
         s = ",\n".join(r)
@@ -132,6 +212,169 @@ class Strip(list):
                 (type(self).__name__,self.w,self.h,self.W,self.H,self.x,self.y,s_i)
 
 
+    def invalidate(self):
+        "Mark the strip and its ancestors for updating their sizes and scores."
+        strip = self
+        while strip is not None and not strip.dirty:
+            strip.dirty = True
+            strip = strip.parent
+        self.forget_scores(True)
+
+    def forget_scores(self,covered=False):
+        """
+        Drop the cached fill_score of the strip and those of its
+        ancestors, which include it. With covered, drop the cached
+        covered areas too.
+        """
+        strip = self
+        while strip is not None and (strip.fill_cache is not None or
+                                     strip.elements_cache is not None or
+                                     covered and
+                                     strip.covered_cache is not None):
+            strip.fill_cache = strip.elements_cache = None
+            if covered:
+                strip.covered_cache = None
+            strip = strip.parent
+
+    def _adopt(self,elements):
+        for e in elements:
+            e.parent = self
+        self.invalidate()
+
+    def append(self,e):
+        list.append(self,e)
+        e.parent = self
+        self.invalidate()
+
+    def insert(self,i,e):
+        list.insert(self,i,e)
+        e.parent = self
+        self.invalidate()
+
+    def extend(self,elements):
+        elements = list(elements)
+        list.extend(self,elements)
+        self._adopt(elements)
+
+    def __iadd__(self,elements):
+        self.extend(elements)
+        return self
+
+    def __setitem__(self,i,e):
+        if isinstance(i,slice):
+            e = list(e)
+            list.__setitem__(self,i,e)
+            self._adopt(e)
+        else:
+            list.__setitem__(self,i,e)
+            e.parent = self
+            self.invalidate()
+
+    def __setslice__(self,i,j,elements):
+        elements = list(elements)
+        list.__setslice__(self,i,j,elements)
+        self._adopt(elements)
+
+    def __delitem__(self,i):
+        list.__delitem__(self,i)
+        self.invalidate()
+
+    def __delslice__(self,i,j):
+        list.__delslice__(self,i,j)
+        self.invalidate()
+
+    def pop(self,*args):
+        e = list.pop(self,*args)
+        self.invalidate()
+        return e
+
+    def remove(self,e):
+        list.remove(self,e)
+        self.invalidate()
+
+    def reverse(self):
+        list.reverse(self)
+        self.invalidate()
+
+    def sort(self,*args,**kw):
+        order = list(self)
+        list.sort(self,*args,**kw)
+        for a,b in zip(order,self):
+            if a is not b:
+                self.invalidate()
+                break
+
+    def clone(self,owner=None):
+        "copy the strip tree, sharing the item types, for the tree of owner"
+        return self.copy(owner,[e.clone(owner) for e in self])
+
+    def copy(self,owner,elements=None):
+        """
+        copy the strip for the tree of owner, sharing the elements, or
+        with the given elements instead, which become its children
+        """
+        twin = list.__new__(type(self))
+        twin.w,twin.h,twin.W,twin.H,twin.x,twin.y = \
+            self.w,self.h,self.W,self.H,self.x,self.y
+        twin.dirty = self.dirty
+        twin.space_dirty = self.space_dirty
+        twin.covered_cache = self.covered_cache
+        twin.elements_cache = self.elements_cache
+        twin.fill_cache = self.fill_cache
+        twin.parent = None
+        twin.owner = owner
+        if elements is None:
+            elements = self
+        list.extend(twin,elements)
+        for e in twin:
+            e.parent = twin
+        return twin
+
+    def own_element(self,i):
+        """
+        Return the i-th element, after replacing it by a copy if it
+        belongs to another tree. The elements of the copy stay shared.
+        """
+        e = self[i]
+        if e.owner is not self.owner:
+            pygena.count('node_copy')
+            e = e.copy(self.owner)
+            list.__setitem__(self,i,e)
+            e.parent = self
+        return e
+
+    def own(self,node,index=None):
+        """
+        Return node, a strip or item of the tree of this strip, after
+        copying it and those of its ancestors that belong to another
+        tree. The parent pointers must be valid, see reparent(). The
+        copied strips are updated in the FitIndex, if given.
+        """
+        path = []
+        while node.owner is not self.owner:
+            path.append(node)
+            node = node.parent
+        for old in reversed(path):
+            new = node.own_element(_index_of(node,old))
+            if index is not None and isinstance(new,Strip):
+                index.replace(old,new)
+            node = new
+        return node
+
+    def reparent(self):
+        "Point the parent pointers of the subtree at the strips holding them."
+        for e in self:
+            e.parent = self
+            if isinstance(e,Strip):
+                e.reparent()
+
+    def wrapper(self,item):
+        "Return a new strip of the other orientation holding the item."
+        s = self.ortho()
+        s.owner = self.owner
+        s.append(item)
+        return s
+
     def area(self):
         return self.w * self.h
         
@@ -139,19 +382,34 @@ class Strip(list):
         return self.W * self.H
 
     def covered_area(self):
-        A = 0
-        for item in self:
-            A += item.covered_area()
-        return A
+        if self.covered_cache is None:
+            A = 0
+            for item in self:
+                A += item.covered_area()
+            self.covered_cache = A
+        return self.covered_cache
     
     def fillrate(self):
         return self.covered_area() / self.area()
 
+    def element_scores(self):
+        "the sum of the fill_scores of the elements"
+        if self.elements_cache is None:
+            score = 0
+            for item in self:
+                score += item.fill_score()
+            self.elements_cache = score
+        return self.elements_cache
+
     def fill_score(self):
-        score = self.available_area()/self.covered_area()-1
-        for item in self:
-            score += item.fill_score()
-        return score
+        """
+        The fill_score is cached on each strip, so after a change only
+        the changed strips and their ancestors are scored again.
+        """
+        if self.fill_cache is None:
+            self.fill_cache = self.available_area()/self.covered_area()-1+\
+                              self.element_scores()
+        return self.fill_cache
 
     def get_items(self):
         items = []
@@ -164,6 +422,34 @@ class Strip(list):
         return items
 
 
+    def canonical_key(self,seen=None):
+        """
+        Return a hashable key of the strip tree.
+
+        The key consists of the strip orientations and nesting order and
+        the sizes, texts and rotations of the items, but not of the item
+        identities. Items occurring twice are marked in the order
+        remove_duplicates() would remove them, so that trees with equal
+        keys are repaired alike.
+        """
+        if seen is None:
+            seen = {}
+        key = [self.__class__]
+        for i in range(len(self)-1,-1,-1):
+            item = self[i]
+            if isinstance(item,Item):
+                t = item.type
+                key.append((t.w,t.h,t.text,t.rotatable,item.rotated,
+                            item.id in seen))
+                seen[item.id] = True
+            else:
+                key.append(item.canonical_key(seen))
+        return tuple(key)
+
+    def layout_hash(self):
+        "hash of the canonical key of the strip tree"
+        return hash(self.canonical_key())
+
     def get_strips(self):
         """Recursively get substrips of a strip."""
         strips = []
@@ -173,18 +459,56 @@ class Strip(list):
         strips.append(self)
         return strips
 
+    def strip_paths(self,path=()):
+        """
+        The pairs of the index paths from this strip and the strips of
+        get_strips(), in the same order.
+        """
+        paths = []
+        for i,item in enumerate(self):
+            if not isinstance(item,Item):
+                paths += item.strip_paths(path+(i,))
+        paths.append((path,self))
+        return paths
+
+    def item_paths(self,path=()):
+        """
+        The pairs of the index paths from this strip and the items of
+        get_items(), in the same order.
+        """
+        paths = []
+        for i,item in enumerate(self):
+            if isinstance(item,Item):
+                paths.append((path+(i,),item))
+            else:
+                paths += item.item_paths(path+(i,))
+        return paths
+
 
     def sort_recursive(self):
         "recursively sort the subitems according to item breadth"
-        # first sort substrips
-        for s in [s for s in self if isinstance(s,Strip)]:
-            s.sort_recursive()
+        # first sort substrips, leaving those of other trees alone if
+        # they are sorted already
+        for i,s in enumerate(self):
+            if isinstance(s,Strip) and \
+                   (s.owner is self.owner or not s.sorted_recursive()):
+                self.own_element(i).sort_recursive()
         # then sort the current strip
         #self.sort(key=lambda s: -s.covered_area()/len(s.get_items()))
         self.sort(key=lambda s:
                   -self.breadth(s))
 
 
+    def sorted_recursive(self):
+        "true if sort_recursive() would not change the subtree"
+        for s in self:
+            if isinstance(s,Strip) and not s.sorted_recursive():
+                return False
+        for a,b in zip(self,self[1:]):
+            if self.breadth(a)<self.breadth(b):
+                return False
+        return True
+
     def fits(self,item):
         """
         Test if the item fits the strip
@@ -200,13 +524,16 @@ class Strip(list):
 
         removes elements from the items list
         """
-
+        index = FitIndex(self.get_strips())
         for item in items[:]:
         #    self.find_place(items,item)
-            strip,rotated = self.find_best_place(item)
+            strip,rotated = self.find_best_place(item,index)
             if rotated:
                 item.rotate()
-            strip.place(items,item)
+            strip = self.own(strip,index)
+            touched = []
+            strip.place(items,item,touched)
+            index.update(touched)
 
 
     def find_place(self,items,item):
@@ -227,40 +554,53 @@ class Strip(list):
                     self.place(items,item)
 
 
-    def place(self,items,item):
-        s = self.ortho()
-        s.append(item)
-        self.append(s)
+    def place(self,items,item,touched=None):
+        """
+        Place the item in a new substrip. The strips whose dimensions
+        change are appended to touched, if given.
+        """
+        self.append(self.wrapper(item))
         items.remove(item)
-        self.update_dimensions(self.W,self.H)
+        # only the changed subtree is updated; the coordinates are
+        # fixed when the whole tree is
+        self.update_sizes(self.W,self.H,x=self.x or 0,y=self.y or 0,
+                          touched=touched)
+        self.update_available_space(self.W,self.H,touched=touched)
 
-    def find_best_place(self,item):
+    def find_best_place(self,item,index=None):
         """
-        find a place for an item with the smallest fill_score increase
+        find a place for an item with the smallest fill_score of the
+        strip subtree it is appended to
+
+        The score of appending to a strip is available/(covered+area)-1
+        plus the cached fill_scores of the present elements, which do
+        not change; the orientation does not affect it. With a FitIndex of
+        the strips, only the strips with enough space are visited; ties
+        go to the strip first in get_strips() order either way.
         """
-        strips = self.get_strips()
+        if index is None:
+            strips = self.get_strips()
+        else:
+            strips = index.candidates(item)
+        area = item.area()
         best_score = 1e308
         best_pos = ()
+        candidates = 0
         for strip in strips:
             av_width,av_height = strip.get_available_space()
-            if item.h<=av_height and item.w<=av_width:
-                strip.append(item)
-                score = strip.fill_score()
-                strip.pop()
-                if score<best_score:
-                    best_score = score
-                    best_pos = (strip,False)
+            fits = item.h<=av_height and item.w<=av_width
             # also try rotated
-            if item.w<=av_height and item.h<=av_width:
-                item.rotate()
-                strip.append(item)
-                score = strip.fill_score()
-                strip.pop()
-                if score<best_score:
-                    best_score = score
-                    best_pos = (strip,True)
-                # rotate the item to its original orientation
-                item.rotate()
+            fits_rotated = item.w<=av_height and item.h<=av_width
+            if not (fits or fits_rotated):
+                continue
+            candidates += fits+fits_rotated
+            score = strip.available_area()/(strip.covered_area()+area)-1+\
+                    strip.element_scores()
+            if score<best_score or score==best_score and \
+                   index is not None and _precedes(strip,best_pos[0]):
+                best_score = score
+                best_pos = (strip,not fits)
+        pygena.count('placement_candidates',candidates)
         return best_pos
 
     def remove_duplicates(self,seen):
@@ -282,37 +622,104 @@ class Strip(list):
                 num_removed += item.remove_duplicates(seen)
         
         return num_removed
-   
+
+    def dedup_sizes(self,seen):
+        """
+        Remove duplicate items like remove_duplicates() and update the
+        sizes of the changed strips on the way, like update_sizes().
+
+        Returns the amount of items removed.
+        """
+        num_removed = 0
+        for i in range(len(self)-1,-1,-1):
+            item = self[i]
+            if isinstance(item,Item):
+                if item.id in seen:
+                    self.pop(i)
+                    num_removed += 1
+                else:
+                    seen[item.id] = True
+            else:
+                if item.owner is not self.owner:
+                    ids = {}
+                    if item.unique_ids(seen,ids):
+                        seen.update(ids)
+                        continue
+                    item = self.own_element(i)
+                num_removed += item.dedup_sizes(seen)
+        if self.dirty:
+            self.update_size()
+            self.dirty = False
+            self.space_dirty = True
+        return num_removed
+
+    def unique_ids(self,seen,ids):
+        """
+        true if dedup_sizes() would not change the subtree: no strip is
+        dirty and no item id is in seen or twice in the subtree. The ids
+        are collected in ids.
+        """
+        if self.dirty:
+            return False
+        for item in self:
+            if isinstance(item,Item):
+                if item.id in seen or item.id in ids:
+                    return False
+                ids[item.id] = True
+            elif not item.unique_ids(seen,ids):
+                return False
+        return True
 
     def fix_layout(self,items,W,H):
         """
         Fix the layout after crossover and mutation operations.
+
+        Removing the duplicates, updating the dimensions and repairing
+        take two traversals, dedup_sizes() and repair_elements(); the
+        layout is the one of separate passes.
         """
         def pdebug(self,s):
             if 0:
                 print s,"-"*20
                 print repr(self)
         pdebug(self,"here 1")
-        nd = self.remove_duplicates({})
-        self.update_dimensions(W,H)
+        seen = {}
+        nd = self.dedup_sizes(seen)
+        if self.x!=0 or self.y!=0 or self.W!=W or self.H!=H:
+            self.space_dirty = True
+        self.x = self.y = 0
+        if self.W!=W or self.H!=H:
+            self.W = W
+            self.H = H
+            self.forget_scores()
 
         pdebug(self,"here 2")
-        nr = self.repair()
+        nr = []
+        self.repair_elements(nr,True)
+        pygena.count('repair_duplicates',nd)
+        pygena.count('repair_drops',len(nr))
 
         self.update_dimensions(W,H)
 
         pdebug(self,"here 3")
-        # get a list of unplaced items
+        # get a list of unplaced items: the ones neither kept by
+        # dedup_sizes() nor dropped. The dict is built as before, as
+        # its order decides the shuffled placement order.
 
         unplaced = {}
         for e in items[:]: unplaced[e.id] = e
-        placed = self.get_items()
-        for p in placed:
-            try: del unplaced[p.id]
+        for d in nr:
+            del seen[d.id]
+        for key in seen:
+            try: del unplaced[key]
             except: pass
-        unplaced = unplaced.values()
+        # place copies, the item list is shared between clones
+        unplaced = [e.clone(self.owner) for e in unplaced.values()]
         random.shuffle(unplaced)
          
+        # populate() finds the strips of the placements by their parent
+        # pointers
+        self.reparent()
         self.populate(unplaced)
 
         self.update_dimensions(W,H,check=True)
@@ -335,33 +742,80 @@ class Strip(list):
         self.update_sizes(W,H,check=check)
         self.update_available_space(W,H)
 
-    def update_sizes(self,W,H,check=False,x=0,y=0):
-        """Update the minimum sizes required to accommodate each subitem."""
-        h = 0
-        w = 0
-
-        self.x = x
-        self.y = y
+    def update_available_space(self,W,H,touched=None):
+        """
+        Update the space available for the strip, skipping subtrees
+        whose space and element sizes have not changed. The updated
+        strips are appended to touched, if given.
+        """
+        if not self.space_dirty and self.W==W and self.H==H:
+            return
+        if self.W!=W or self.H!=H:
+            self.W = W
+            self.H = H
+            self.forget_scores()
+        self.space_dirty = False
+        if touched is not None:
+            touched.append(self)
+
+        for i,(item,w,h) in enumerate(self.child_space()):
+            if isinstance(item,Strip):
+                if item.space_dirty or item.W!=w or item.H!=h:
+                    item = self.own_element(i)
+                item.update_available_space(w,h,touched)
 
+    def update_size(self):
+        """
+        Update the size of the strip from the current sizes of its
+        elements, without recursing into them.
+        """
+        w = h = 0
         for item in self:
-            if isinstance(item,Item):
-                w,h = self.dim_inc(w,h,item.w,item.h)
-                item.x = x
-                item.y = y
-            else:
-                ew,eh = item.update_sizes(W,H,check=check,x=x,y=y)
-                w,h = self.dim_inc(w,h,ew,eh)
+            w,h = self.dim_inc(w,h,item.w,item.h)
+        self.w = w
+        self.h = h
 
-            x,y = self.update_sizes_inc_coord(x,y,item)
+    def update_sizes(self,W,H,check=False,x=0,y=0,touched=None):
+        """
+        Update the minimum sizes required to accommodate each subitem.
+        Subtrees that have neither changed nor moved are skipped; the
+        updated strips are appended to touched, if given.
+        """
+        if self.dirty or self.x!=x or self.y!=y:
+            if touched is not None:
+                touched.append(self)
+            h = 0
+            w = 0
+
+            self.x = x
+            self.y = y
+
+            for i,item in enumerate(self):
+                if isinstance(item,Item):
+                    w,h = self.dim_inc(w,h,item.w,item.h)
+                    if item.x!=x or item.y!=y:
+                        item = self.own_element(i)
+                        item.x = x
+                        item.y = y
+                else:
+                    if item.dirty or item.x!=x or item.y!=y:
+                        item = self.own_element(i)
+                    ew,eh = item.update_sizes(W,H,check=check,x=x,y=y,
+                                              touched=touched)
+                    w,h = self.dim_inc(w,h,ew,eh)
 
-        self.h = h
-        self.w = w
+                x,y = self.update_sizes_inc_coord(x,y,item)
+
+            self.h = h
+            self.w = w
+            self.dirty = False
+            self.space_dirty = True
 
         if check:
             assert(self.w+self.x<=W)
             assert(self.h+self.y<=H)
 
-        return w,h
+        return self.w,self.h
 
     def repair_strip(self,i,item):
         """
@@ -391,11 +845,42 @@ class Strip(list):
         with the same orientation.
         """
         dropped = []
+        self.repair_elements(dropped,False)
+        return dropped
+
+    def repair_elements(self,dropped,place):
+        """
+        Repair the strip like repair(), appending the dropped items to
+        dropped. With place, first set the coordinates and the space of
+        the elements like update_dimensions(), where the size of an
+        element or the place of the strip has changed, so that no
+        separate update is needed.
+        """
+        if place and self.space_dirty:
+            x,y = self.x,self.y
+            for i,(item,w,h) in enumerate(self.child_space()):
+                if isinstance(item,Strip):
+                    if item.x!=x or item.y!=y or item.W!=w or item.H!=h:
+                        item = self.own_element(i)
+                        item.space_dirty = True
+                    if item.W!=w or item.H!=h:
+                        item.W = w
+                        item.H = h
+                        item.forget_scores()
+                if item.x!=x or item.y!=y:
+                    item = self.own_element(i)
+                    item.x = x
+                    item.y = y
+                x,y = self.update_sizes_inc_coord(x,y,item)
+            self.space_dirty = False
 
         for i in range(len(self)-1,-1,-1):
             item = self[i]
             if isinstance(item,Strip):
-                dropped += item.repair()
+                if item.owner is self.owner or \
+                       not item.repaired(place):
+                    item = self.own_element(i)
+                    item.repair_elements(dropped,place)
                 self.repair_strip(i,item)
             else:
                 if not self.fits(item):
@@ -404,19 +889,29 @@ class Strip(list):
                 elif self.breadth(item)<self.B:
                     # only wrap items if their breadth is less than
                     # the available breadth
-                    s = self.ortho()
-                    s.append(item)
-                    self[i] = s
-        return dropped
+                    self[i] = self.wrapper(item)
+
+    def repaired(self,place):
+        "true if repair_elements() would not change the subtree"
+        if place and self.space_dirty:
+            return False
+        for item in self:
+            if isinstance(item,Strip):
+                if not item.repaired(place) or len(item)==0 or \
+                       isinstance(item,type(self)) or \
+                       isinstance(item,self.ortho) and len(item)==1 and \
+                       isinstance(item[0],type(self)):
+                    return False
+            elif not self.fits(item) or self.breadth(item)<self.B:
+                return False
+        return True
 
 
 
 class HStrip(Strip):
     "A horizontal strip of items and other strips"
 
-    def __init__(self,*args,**kw):
-        self.ortho = VStrip
-        super(HStrip,self).__init__(*args,**kw)
+    __slots__ = ()
 
     def __str__(self):
         return "H(%s,%s,%s,%s)" % (self.w,self.h,self.W,self.H)
@@ -441,18 +936,13 @@ class HStrip(Strip):
         av_height = self.H
         return av_width,av_height
 
-    def update_available_space(self,W,H):
-        """
-        Update the space available for the strip
-        """
-        self.W = W
-        self.H = H
-
+    def child_space(self):
+        "Yield the elements with the width and height available for each."
+        W = self.W
         for item in self:
             w = min(item.w,W)
             W -= w
-            if isinstance(item,Strip):
-                item.update_available_space(w,H)
+            yield item,w,self.H
 
     def update_sizes_inc_coord(self,x,y,item):
         x = x+item.w
@@ -464,10 +954,9 @@ class HStrip(Strip):
 
 class VStrip(Strip):
     "A vertical strip of items and other strips"
-    
-    def __init__(self,*args,**kw):
-        self.ortho = HStrip
-        super(VStrip,self).__init__(*args,**kw)
+
+    __slots__ = ()
+    ortho = HStrip
 
     def __str__(self):
         return "V(%s,%s,%s,%s)" % (self.w,self.h,self.W,self.H)
@@ -492,18 +981,13 @@ class VStrip(Strip):
         av_height = self.H-self.h
         return av_width,av_height
 
-    def update_available_space(self,W,H):
-        """
-        Update the space available for the strip
-        """
-        self.W = W
-        self.H = H
-
+    def child_space(self):
+        "Yield the elements with the width and height available for each."
+        H = self.H
         for item in self:
             h = min(item.h,H)
             H -= h
-            if isinstance(item,Strip):
-                item.update_available_space(W,h)
+            yield item,self.W,h
 
     def update_sizes_inc_coord(self,x,y,item):
         y = y+item.h
@@ -513,7 +997,270 @@ class VStrip(Strip):
         self.h += dh
         self.w = max(self.w,item.w)
 
+HStrip.ortho = VStrip
+
+
+def _precedes(a,b):
+    "true if strip a comes before strip b in get_strips() order"
+    ancestors = {}
+    node = b
+    while node is not None:
+        ancestors[id(node)] = True
+        node = node.parent
+    child = None
+    node = a
+    while id(node) not in ancestors:
+        child = node
+        node = node.parent
+    if node is a:
+        # a is b or its ancestor, which come after b
+        return False
+    if node is b:
+        return True
+    other = b
+    while other.parent is not node:
+        other = other.parent
+    return _index_of(node,child)<_index_of(node,other)
+
+
+class FitIndex(object):
+    """
+    Index of strips by their available space, so that the strips an
+    item fits in are found without visiting the others. The strips are
+    kept sorted by available width; a query scans the ones at least as
+    wide as the narrower side of the item.
+    """
+
+    def __init__(self,strips):
+        self.keys = {}
+        self.widths = []
+        self.strips = []
+        for strip in strips:
+            self.add(strip)
+
+    def add(self,strip):
+        av_width = strip.get_available_space()[0]
+        i = bisect.bisect_right(self.widths,av_width)
+        self.widths.insert(i,av_width)
+        self.strips.insert(i,strip)
+        self.keys[id(strip)] = av_width
+
+    def discard(self,strip):
+        key = self.keys.pop(id(strip),None)
+        if key is None:
+            return
+        i = bisect.bisect_left(self.widths,key)
+        while self.strips[i] is not strip:
+            i += 1
+        del self.widths[i]
+        del self.strips[i]
+
+    def replace(self,old,new):
+        "index the copy new of the strip old in its place"
+        key = self.keys.pop(id(old))
+        i = bisect.bisect_left(self.widths,key)
+        while self.strips[i] is not old:
+            i += 1
+        self.strips[i] = new
+        self.keys[id(new)] = key
+
+    def update(self,strips):
+        "re-index the strips whose space has changed"
+        for strip in strips:
+            self.discard(strip)
+            self.add(strip)
+
+    def candidates(self,item):
+        "the strips wide enough for the item in some orientation"
+        i = bisect.bisect_left(self.widths,min(item.w,item.h))
+        return self.strips[i:]
+
+
+def _index_of(strip,element):
+    "index of the element in the strip by identity"
+    for i,e in enumerate(strip):
+        if e is element:
+            return i
+    raise ValueError('element not in strip')
+
+
+class LocalSearch(object):
+    """
+    Hill climbing on a complete layout by rotating, swapping and moving
+    items between strips.
+
+    A move only re-evaluates the strips it affects: the sizes on the
+    paths from the changed strips to the root and the space of the
+    strips whose allocation changes. The fill_score comes from the
+    caches of the strips, which are recomputed for the changed strips
+    only. The changes are journaled, so a rejected move is undone
+    without evaluating anything.
+    """
+
+    def __init__(self,strip,W,H):
+        self.root = strip
+        self.W = W
+        self.H = H
+        self.strips = []
+        self.items = []
+        strip.update_dimensions(W,H)
+        self._index(strip)
+        self.journal = []
+        self.saved = {}
+
+    def _index(self,strip):
+        self.strips.append(strip)
+        for item in strip:
+            item.parent = strip
+            if isinstance(item,Item):
+                self.items.append(item)
+            else:
+                self._index(item)
+
+    def score(self):
+        "the score of StripChromosome.evaluate()"
+        return self.root.w+self.root.fill_score()/self.root.w
+
+    def valid(self):
+        return self.root.w<=self.W and self.root.h<=self.H
+
+    def _save(self,node):
+        "journal the cached state of the node once per move"
+        key = id(node)
+        if key in self.saved:
+            return
+        self.saved[key] = True
+        state = (node.w,node.h,node.W,node.H)
+        def restore():
+            node.w,node.h,node.W,node.H = state
+            node.forget_scores()
+        self.journal.append(restore)
+
+    def _update(self,dirty):
+        """
+        Re-evaluate after the elements of the dirty strips changed:
+        sizes bottom up along the paths, then the available space top
+        down wherever it or the size changed.
+        """
+        changed = {}
+        for node in dirty:
+            while node is not self.root.parent:
+                self._save(node)
+                node.update_size()
+                changed[id(node)] = True
+                node = node.parent
+        self._allocate(self.root,self.root.W,self.root.H,changed)
+
+    def _allocate(self,node,W,H,changed):
+        if W==node.W and H==node.H and id(node) not in changed:
+            return
+        self._save(node)
+        if W!=node.W or H!=node.H:
+            node.W = W
+            node.H = H
+            node.forget_scores()
+        for item,w,h in node.child_space():
+            if isinstance(item,Strip):
+                self._allocate(item,w,h,changed)
+
+    def rotate(self,item):
+        item.rotate()
+        self.journal.append(item.rotate)
+        self._update([item.parent])
+
+    def swap(self,a,b):
+        pa = a.parent
+        pb = b.parent
+        i = _index_of(pa,a)
+        j = _index_of(pb,b)
+        pa[i] = b
+        pb[j] = a
+        def undo():
+            pb[j] = b
+            pa[i] = a
+        self.journal.append(undo)
+        self._update([pa,pb])
+
+    def move(self,item,target):
+        """
+        Move the item into a new substrip at the end of the target
+        strip, removing the strips left empty.
+        """
+        source = item.parent
+        i = _index_of(source,item)
+        wrapper = target.wrapper(item)
+        target.append(wrapper)
+        self.strips.append(wrapper)
+        source.pop(i)
+        def undo():
+            target.pop()
+            self.strips.pop()
+            source.insert(i,item)
+        self.journal.append(undo)
+        emptied = source
+        # an emptied strip keeps its parent pointer for the undo
+        while len(emptied)==0:
+            self._prune(emptied)
+            emptied = emptied.parent
+        self._update([wrapper,emptied])
+
+    def _prune(self,strip):
+        parent = strip.parent
+        i = _index_of(parent,strip)
+        j = _index_of(self.strips,strip)
+        parent.pop(i)
+        self.strips.pop(j)
+        def undo():
+            self.strips.insert(j,strip)
+            parent.insert(i,strip)
+        self.journal.append(undo)
+
+    def random_move(self):
+        "make a random move; return false if the move is void"
+        item = random.choice(self.items)
+        r = random.random()
+        if r<1./3:
+            if not item.rotatable:
+                return False
+            self.rotate(item)
+        elif r<2./3:
+            other = random.choice(self.items)
+            if other is item:
+                return False
+            self.swap(item,other)
+        else:
+            target = random.choice(self.strips)
+            if target is item.parent:
+                return False
+            self.move(item,target)
+        return True
 
+    def rollback(self):
+        for undo in reversed(self.journal):
+            undo()
+
+    def run(self,steps):
+        """
+        Try steps random moves, keeping those that improve the score.
+        Return the number of moves kept.
+        """
+        score = self.score()
+        accepted = 0
+        for k in range(steps):
+            self.journal = []
+            self.saved = {}
+            if not self.random_move():
+                continue
+            # the margin keeps rounding noise from passing as a gain
+            if self.valid() and self.score()<score-1e-9:
+                score = self.score()
+                accepted += 1
+            else:
+                self.rollback()
+        self.journal = []
+        pygena.count('local_search_moves',steps)
+        pygena.count('local_search_accepted',accepted)
+        return accepted
 
 
 class StripChromosome(pygena.BaseChromosome):
@@ -523,22 +1270,29 @@ class StripChromosome(pygena.BaseChromosome):
     random_order = False
     item_min_dim = 0
     optimization = pygena.MINIMIZE
+    features = None # the signature, reset by repair()
+    owner = None # the token of the strips the chromosome may change
+    lazy_repair = True
     def __init__(self):
         pygena.BaseChromosome.__init__(self)
-        self.items = copy.deepcopy(StripChromosome.items)
+        # the items are only a template, shared by the chromosomes
+        self.items = StripChromosome.items
         self.strip = None
         self.randomize()
         self.repair()
         
     def _random_rotate_items(self):
+        self.items = [item.clone() for item in self.items]
         for item in self.items:
             if item.rotatable and random.randint(0,1):
                 item.rotate()  
 
     def randomize(self):
-        items = self.items[:]
+        self.owner = object()
+        items = [item.clone(self.owner) for item in self.items]
         # TODO: randomize between HStrip and VStrip
         self.strip = HStrip()
+        self.strip.owner = self.owner
         self.strip.update_dimensions(self.W,self.H)
         #self._random_rotate_items()
         if self.random_order:
@@ -549,62 +1303,168 @@ class StripChromosome(pygena.BaseChromosome):
         # force changes in the chromosome
         #self.mutate(100.0)
 
-    def crossover(self,other):
+    def crossover(self,other,repair=True,wanted=2):
         """
         perform crossover operation on two strip trees.
-        return two copies after the operation without repairing them.
+        return two copies after the operation, repaired if repair,
+        or only the first if wanted is 1.
         """
 
         valid = False
 
-        sc = copy.deepcopy(self)
-        oc = copy.deepcopy(other)
-
-        sc_strips = sc.strip.get_strips()
-        oc_strips = oc.strip.get_strips()
+        sc_strips = self.strip.strip_paths()
+        oc_strips = other.strip.strip_paths()
 
         c1 = random.randint(0,len(sc_strips)-1)
         c2 = random.randint(0,len(oc_strips)-1)
 
-        c1i = random.randint(0,len(sc_strips[c1]))
-        c2i = random.randint(0,len(oc_strips[c2]))
+        c1i = random.randint(0,len(sc_strips[c1][1]))
+        c2i = random.randint(0,len(oc_strips[c2][1]))
 
-        sc_strips[c1][c1i:], oc_strips[c2][c2i:] = \
-                oc_strips[c2][c2i:], sc_strips[c1][c1i:]
+        # the offspring copy the crossed strips and their ancestors
+        # only, sharing the rest of the trees with the parents
+        sc = self.clone()
+        tail = oc_strips[c2][1][c2i:]
+        offspring = (sc,)
+        if wanted > 1:
+            oc = other.clone()
+            oc._own_path(oc_strips[c2][0])[c2i:] = sc_strips[c1][1][c1i:]
+            offspring = (sc,oc)
+        sc._own_path(sc_strips[c1][0])[c1i:] = tail
 
         # repair the offspring
-        sc.repair()
-        oc.repair()
+        if repair:
+            for c in offspring:
+                c.repair()
         
         # return the object copies
-        return (sc,oc)
+        return offspring
         
-    def mutate(self,mutation_rate):
-        mutated = False
-        items = self.strip.get_items()
-        strips = self.strip.get_strips()
-        for item in items:
+    def mutate(self,mutation_rate,repair=True):
+        "Mutate, repairing if repair. Return True if anything changed."
+        items = self.strip.item_paths()
+        changes = []
+        for i in range(len(items)):
             if random.random() < mutation_rate/len(items):
-                r2 = random.random()
-                #if r2 < 1./3:
-                #    self.strip.find(item).transpose()
-                if r2 < 0.5 and item.rotatable:
-                    item.rotate()
-                else:
-                    # drop the item
-                    for s in strips:
-                        if item in s:
-                            s.remove(item)
-                            break
-                mutated = True
-        if mutated:
+                changes.append((items[i],random.random()))
+        # the later items first, so that the drops do not move the
+        # items still to change
+        for (path,item),r2 in reversed(changes):
+            strip = self._own_path(path[:-1])
+            #if r2 < 1./3:
+            #    self.strip.find(item).transpose()
+            if r2 < 0.5 and item.rotatable:
+                strip.own_element(path[-1]).rotate()
+            else:
+                # drop the item
+                strip.pop(path[-1])
+        mutated = len(changes)>0
+        if mutated and repair:
             self.repair()
+        return mutated
+
+    def local_search(self,steps):
+        "Improve the layout in place by steps moves (see LocalSearch)."
+        # the moves may change any strip, so the search works on a copy
+        # of the whole tree
+        pygena.count('strip_copy')
+        self.owner = object()
+        self.strip = self.strip.clone(self.owner)
+        search = LocalSearch(self.strip,self.W,self.H)
+        if search.run(steps):
+            self.strip.update_dimensions(self.W,self.H,check=True)
+            self.features = None
+            self.evaluate()
+
+    def clone(self):
+        """
+        Copy the chromosome, sharing the strip tree. The item list is
+        only used as a template and is shared.
+
+        The strips and items of the tree belong to the chromosome whose
+        owner token they carry. Neither copy owns the shared tree: the
+        methods changing it copy the strips on the path from the root to
+        the changed element first, which share the other elements, so
+        the untouched subtrees stay shared (see Strip.own_element()).
+        Crossover copies the paths to the crossed strips only.
+        """
+        pygena.count('clone')
+        twin = self.__class__.__new__(self.__class__)
+        twin.__dict__.update(self.__dict__)
+        self.owner = twin.owner = None
+        return twin
+
+    def _own_root(self):
+        "Return the root strip, copied first unless the chromosome owns it."
+        if self.owner is None or self.strip.owner is not self.owner:
+            pygena.count('strip_copy')
+            self.owner = object()
+            self.strip = self.strip.copy(self.owner)
+        return self.strip
+
+    def _own_path(self,path):
+        """
+        Return the strip at the index path from the root, copied with
+        its ancestors first where the chromosome does not own them.
+        """
+        strip = self._own_root()
+        for i in path:
+            strip = strip.own_element(i)
+        return strip
 
     def repair(self):
-        self.strip.fix_layout(self.items,self.W,self.H)
+        self.features = None
+        cache = self.cache
+        if cache is not None:
+            # the cached layouts contain every template item once,
+            # so they are valid for any chromosome
+            key = self.strip.canonical_key()
+            cached = cache.get(key)
+            if cached is not None:
+                self.strip,self.score = cached
+                self.owner = None
+                return
+        strip = self._own_root()
+        with pygena.phase('repair'):
+            strip.fix_layout(self.items,self.W,self.H)
         # must have all items in the layout
         assert(len(self.strip.get_items())==len(self.items)) 
-        self.evaluate()
+        with pygena.phase('evaluation'):
+            self.evaluate()
+        if cache is not None:
+            cache.put(key,(self.strip,self.score))
+            self.owner = None
+
+    def fingerprint(self):
+        return self.strip.canonical_key()
+
+    def signature(self):
+        """
+        The rotated items and the pairs of items next to each other
+        in the same strip, by item id. Computed once per layout, so
+        that distance() is a set operation.
+        """
+        if self.features is None:
+            features = []
+            for strip in self.strip.get_strips():
+                ids = [item.id for item in strip if isinstance(item,Item)]
+                features += zip(ids,ids[1:])
+            features += [('r',item.id) for item in self.strip.get_items()
+                         if item.rotated]
+            self.features = frozenset(features)
+        return self.features
+
+    @classmethod
+    def class_state(cls):
+        # the template items define the item ids of the layouts
+        return dict(items=cls.items,H=cls.H,W=cls.W,
+                    random_order=cls.random_order,
+                    item_min_dim=cls.item_min_dim)
+
+    @classmethod
+    def set_class_state(cls,state):
+        for name,value in state.items():
+            setattr(cls,name,value)
 
     def evaluate(self):
         #self.score = self.strip.w/math.sqrt(self.strip.fillrate())
@@ -616,7 +1476,30 @@ class StripChromosome(pygena.BaseChromosome):
                  self.strip.h, self.strip.fill_score())
 
 
-def optimize(items,H,generations=200,plateau=20,pop_size=100,verbose=False,randomize=False):
+def optimize(items,H,generations=200,plateau=20,pop_size=100,verbose=False,
+             randomize=False,workers=None,islands=None,cache_size=None,
+             reject_duplicates=False,stats_file=None,checkpoint=None,
+             checkpoint_interval=10,resume=False,steady_state=False,
+             time_budget=None,progress=None,stop=None,crowding=None,
+             local_search=0,local_search_steps=20):
+    """
+    Lay out the items on a strip of height H and return the strip length
+    and the placed items.
+
+    The run stops after time_budget seconds, if given, or when stop()
+    returns true. progress is called with the length, the fill rate and
+    copies of the items of each improved layout. crowding is the window
+    size of the restricted tournament replacement, if used. Each
+    generation, the local_search best layouts are improved by
+    local_search_steps local moves.
+
+    With islands, each island is a process of its own: workers,
+    checkpoint and resume are not supported, and the island i
+    statistics go to stats_file.i.
+    """
+    if islands and (workers or checkpoint or resume):
+        raise ValueError('islands cannot be combined with workers, '
+                         'checkpoint or resume')
     items.sort(key=lambda x: x.area(), reverse=True)
     StripChromosome.items = items
     StripChromosome.H = H
@@ -627,18 +1510,64 @@ def optimize(items,H,generations=200,plateau=20,pop_size=100,verbose=False,rando
     StripChromosome.item_min_dim = \
         min([i.h for i in items]+[i.w for i in items])
     
-    env = pygena.Population(StripChromosome, maxgenerations=generations,
-                            maxplateau=plateau,
-                            optimum=0,
-                            tournament=pygena.roulette_tournament,
-                            size=pop_size,
-                            crossover_rate=0.7, mutation_rate=0.3)
-    best = env.run()
+    kw = dict(maxgenerations=generations,
+              maxplateau=plateau,
+              optimum=0,
+              tournament=pygena.roulette_tournament,
+              size=pop_size,
+              crossover_rate=0.7, mutation_rate=0.3,
+              cache_size=cache_size,
+              reject_duplicates=reject_duplicates,
+              stats_file=stats_file,
+              time_budget=time_budget,
+              stop=stop,
+              crowding=crowding,
+              local_search=local_search,
+              local_search_steps=local_search_steps,
+              report_callback=(pygena.quiet_report,
+                               pygena.default_report)[verbose])
+    if progress is not None:
+        def on_improvement(best):
+            progress(best.strip.w,best.strip.fillrate(),
+                     [i.clone() for i in best.strip.get_items()])
+        kw['on_improvement'] = on_improvement
+    migration_interval = 5
+    if steady_state:
+        # replace two individuals per step; a population's worth of
+        # offspring counts as a generation, also for the intervals
+        steps = max(1,pop_size//2)
+        kw.update(maxgenerations=generations*steps,
+                  maxplateau=plateau*steps,
+                  report_interval=steps,
+                  steady_state=True,steady_offspring=2)
+        checkpoint_interval *= steps
+        migration_interval *= steps
+    if islands:
+        best = island_model.run_islands(StripChromosome,islands,
+                                        migration_interval=\
+                                            migration_interval,
+                                        **kw)
+    elif resume:
+        # continue with the items and layouts of the checkpoint
+        env = pygena.Population.resume(StripChromosome,checkpoint,
+                                       workers=workers,
+                                       checkpoint=checkpoint,
+                                       checkpoint_interval=\
+                                           checkpoint_interval,
+                                       **kw)
+        best = env.run()
+    else:
+        env = pygena.Population(StripChromosome,workers=workers,
+                                checkpoint=checkpoint,
+                                checkpoint_interval=checkpoint_interval,
+                                **kw)
+        best = env.run()
     best.strip.update_dimensions(StripChromosome.W,StripChromosome.H)
-    pickle.dump(best,open("striped_ga.pickle","w"))
     output_items = best.strip.get_items()
 
-    print "output_items:", len(output_items)
+    if verbose:
+        pickle.dump(best,open("striped_ga.pickle","w"))
+        print "output_items:", len(output_items)
 
     #best.strip.dump()
     
@@ -4,6 +4,9 @@ import unittest
 from striped_ga import *
 import pdb
 import copy
+import cPickle
+import random
+import pygena
 
 t1 = ItemType(1500, 100)
 t2 = ItemType(300, 300)
@@ -18,6 +21,35 @@ i4 = Item(t3)
 
 items = [i1,i2,i3,i4]
 
+def uncached_fill_score(strip):
+    "the fill_score computed without the caches"
+    covered = 0
+    elements = 0
+    for item in strip:
+        if isinstance(item,Item):
+            covered += item.area()
+        else:
+            covered += sum([i.area() for i in item.get_items()])
+            elements += uncached_fill_score(item)
+    return float(strip.available_area())/covered-1+elements
+
+def separate_fix_layout(strip,items,W,H):
+    "fix_layout() as separate passes"
+    strip.remove_duplicates({})
+    strip.update_dimensions(W,H)
+    strip.repair()
+    strip.update_dimensions(W,H)
+    unplaced = {}
+    for e in items[:]: unplaced[e.id] = e
+    for p in strip.get_items():
+        del unplaced[p.id]
+    unplaced = [e.clone() for e in unplaced.values()]
+    random.shuffle(unplaced)
+    strip.populate(unplaced)
+    strip.update_dimensions(W,H,check=True)
+    strip.sort_recursive()
+    strip.update_dimensions(W,H,check=True)
+
 class TestSequenceFunctions(unittest.TestCase):
     def test_basic_layout(self):
         s = HStrip()
@@ -391,6 +423,390 @@ class TestSequenceFunctions(unittest.TestCase):
         score = strip.fill_score()
         self.assertEqual(score,1000.*1000/(400*400)-1+1000.*400/(400*400)-1)
 
+    def test_pickle_item_types(self):
+        """types must keep their identity across pickling"""
+        ta = ItemType(123,456)
+        tb = ItemType(789,654)
+        a,b,c = cPickle.loads(cPickle.dumps([Item(ta),Item(tb),Item(tb)],2))
+        self.assertEqual((a.w,a.h),(123,456))
+        self.assertEqual((b.w,b.h),(789,654))
+        self.assert_(b.type is c.type)
+        self.assert_(a.type is not b.type)
+
+    def test_pickle_strips(self):
+        """pickled trees keep their parent pointers"""
+        s = HStrip(list_=[VStrip(list_=[Item(t1),Item(t2,rotated=True)]),
+                          Item(t3)])
+        s.update_dimensions(3000,3000)
+        for protocol in (0,2):
+            twin = cPickle.loads(cPickle.dumps(s,protocol))
+            self.assertEqual(repr(twin),repr(s))
+            self.assert_(twin.parent is None)
+            self.assert_(twin[0].parent is twin)
+            self.assert_(twin[0][1].parent is twin[0])
+            self.assertEqual((twin[0][1].w,twin[0][1].h),(t2.h,t2.w))
+            self.failIf(twin.dirty)
+        self.failIf(hasattr(s,'__dict__'))
+        self.failIf(hasattr(s[1],'__dict__'))
+
+    def test_clone(self):
+        """clones share the item types but no mutable nodes"""
+        s = HStrip()
+        v = VStrip()
+        v.append(Item(t1))
+        v.append(Item(t2))
+        s.append(v)
+        s.append(Item(t3))
+        s.update_dimensions(4000,2000)
+
+        c = s.clone()
+        self.assertEqual(repr(c),repr(s))
+        self.assert_(c[0] is not v)
+        self.assert_(c[0][0] is not v[0])
+        self.assert_(c[0][0].type is v[0].type)
+        c[0][0].rotate()
+        self.assertEqual(v[0].rotated,False)
+
+    def test_canonical_key(self):
+        """keys ignore item identities but not the structure"""
+        def layout(a,b,c):
+            s = HStrip()
+            v = VStrip()
+            v.append(a)
+            v.append(b)
+            s.append(v)
+            s.append(c)
+            return s
+        s1 = layout(Item(t1),Item(t2),Item(t3))
+        s2 = layout(Item(t1),Item(t2),Item(t3))
+        s3 = layout(Item(t2),Item(t1),Item(t3))
+        self.assertEqual(s1.canonical_key(),s2.canonical_key())
+        self.assertEqual(s1.layout_hash(),s2.layout_hash())
+        self.assertNotEqual(s1.canonical_key(),s3.canonical_key())
+        s2[1].rotate()
+        self.assertNotEqual(s1.canonical_key(),s2.canonical_key())
+        # a duplicated item differs from two distinct ones
+        a = Item(t1)
+        self.assertNotEqual(layout(a,Item(t2),Item(t1)).canonical_key(),
+                            layout(a,Item(t2),a).canonical_key())
+
+    def test_signature_distance(self):
+        random.seed(1)
+        StripChromosome.items = [Item(t) for t in (t1,t1,t2,t2,t3,t3)]
+        StripChromosome.H = 2000
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        a = StripChromosome()
+        b = a.clone()
+        self.assertEqual(a.distance(b),0.)
+        self.assert_(a.signature() is a.signature())
+        while not b.mutate(2.0):
+            pass
+        self.assert_(0.<a.distance(b)<=1.)
+        self.assertEqual(a.distance(b),b.distance(a))
+
+    def test_shared_strips(self):
+        """clones share the tree until one of them changes it"""
+        random.seed(7)
+        StripChromosome.items = [Item(t) for t in (t1,t1,t2,t2,t3,t3)]
+        StripChromosome.H = 2000
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        a = StripChromosome()
+        b = StripChromosome()
+        before = repr(a.strip),repr(b.strip)
+        c = a.clone()
+        self.assert_(c.strip is a.strip)
+        c.mutate(0.)
+        self.assert_(c.strip is a.strip)
+        c.mutate(100.)
+        self.assert_(c.strip is not a.strip)
+        for k in range(5):
+            d,e = a.crossover(b)
+            self.assert_(d.strip is not a.strip)
+            self.assertEqual((repr(a.strip),repr(b.strip)),before)
+        d.local_search(50)
+        self.assertEqual((repr(a.strip),repr(b.strip)),before)
+
+    def test_path_copying(self):
+        """offspring copy the crossed strips and their ancestors only"""
+        random.seed(4)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(4)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        a = StripChromosome()
+        b = StripChromosome()
+        before = repr(a.strip),repr(b.strip)
+        parents = set(map(id,a.strip.get_strips()+a.strip.get_items()+
+                          b.strip.get_strips()+b.strip.get_items()))
+        shared = 0
+        for k in range(10):
+            stats = pygena.Stats()
+            pygena.activate(stats)
+            c, = a.crossover(b,repair=False,wanted=1)
+            pygena.activate(None)
+            strips = c.strip.get_strips()
+            path = [s for s in strips if s.owner is c.owner]
+            self.assert_(len(path)<len(strips))
+            self.assertEqual(stats.counters.get('node_copy',0),len(path)-1)
+            for s in path[:-1]:
+                self.assert_(s.parent.owner is c.owner)
+                self.assert_([e for e in s.parent if e is s])
+            c.mutate(1.0,repair=False)
+            c.repair()
+            nodes = c.strip.get_strips()+c.strip.get_items()
+            shared += len([n for n in nodes if id(n) in parents])
+            self.assertEqual((repr(a.strip),repr(b.strip)),before)
+        # the repairs keep some of the untouched subtrees
+        self.assert_(shared>0)
+
+    def test_local_search_incremental(self):
+        """moves update the dimensions and the fill score like a full
+        re-evaluation, and rejected moves are undone exactly"""
+        random.seed(3)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(4)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        c = StripChromosome()
+        search = LocalSearch(c.strip,c.W,c.H)
+        for k in range(200):
+            before = c.strip.clone()
+            before.update_dimensions(c.W,c.H)
+            fill_score = c.strip.fill_score()
+            search.journal = []
+            search.saved = {}
+            if not search.random_move():
+                continue
+            full = c.strip.clone()
+            full.update_dimensions(c.W,c.H)
+            self.assertEqual(c.strip.fill_score(),uncached_fill_score(full))
+            self.assertEqual((c.strip.w,c.strip.h),(full.w,full.h))
+            if k%2:
+                search.rollback()
+                c.strip.update_dimensions(c.W,c.H)
+                self.assertEqual(repr(c.strip),repr(before))
+                self.assertEqual(c.strip.fill_score(),fill_score)
+
+    def test_optimize_islands_options(self):
+        items = [Item(t) for t in (t1,t2,t3)]
+        for kw in [dict(workers=2),dict(checkpoint='x'),dict(resume=True)]:
+            self.assertRaises(ValueError,optimize,items,2000,islands=2,
+                              **kw)
+
+    def test_local_search(self):
+        random.seed(3)
+        StripChromosome.items = [Item(t) for t in (t1,t1,t2,t2,t3,t3)]
+        StripChromosome.H = 2000
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        c = StripChromosome()
+        score = c.score
+        c.local_search(100)
+        self.assert_(c.score<=score)
+        self.assertEqual(len(c.strip.get_items()),6)
+        full = c.clone()
+        full.strip.update_dimensions(c.W,c.H,check=True)
+        full.evaluate()
+        self.assertEqual(full.score,c.score)
+
+    def test_parent_pointers(self):
+        s = HStrip()
+        v = VStrip()
+        a = Item(t1)
+        b = Item(t2)
+        v.append(a)
+        s.append(v)
+        s.insert(0,b)
+        self.assert_(a.parent is v and v.parent is s and b.parent is s)
+        w = VStrip()
+        s[1:2] = [w]
+        self.assert_(w.parent is s)
+        c = s.clone()
+        self.assert_(c[1].parent is c and c[0].parent is c)
+        self.assert_(c.parent is None)
+
+    def test_incremental_dimensions(self):
+        """skipping the clean subtrees gives the full update's result"""
+        def full(strip):
+            strip = strip.clone()
+            for s in strip.get_strips():
+                s.dirty = s.space_dirty = True
+            strip.update_dimensions(c.W,c.H)
+            return repr(strip)
+        random.seed(2)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(4)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        c = StripChromosome()
+        d = StripChromosome()
+        for k in range(10):
+            c,d = c.crossover(d)
+            c.mutate(2.0)
+            self.assertEqual(repr(c.strip),full(c.strip))
+            c.strip.get_items()[0].rotate()
+            c.strip.get_strips()[0].pop()
+            c.strip.update_dimensions(c.W,c.H)
+            self.assertEqual(repr(c.strip),full(c.strip))
+            for s in c.strip.get_strips():
+                self.failIf(s.dirty)
+
+    def test_lazy_repair(self):
+        """unrepaired offspring are valid after a single repair"""
+        random.seed(9)
+        StripChromosome.items = [Item(t) for t in (t1,t1,t2,t2,t3,t3)]
+        StripChromosome.H = 2000
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        a = StripChromosome()
+        b = StripChromosome()
+        before = repr(a.strip),repr(b.strip)
+        for k in range(10):
+            wanted = k%2+1
+            stats = pygena.Stats()
+            pygena.activate(stats)
+            offspring = a.crossover(b,repair=False,wanted=wanted)
+            pygena.activate(None)
+            self.assertEqual(len(offspring),wanted)
+            # only the trees of the wanted offspring are copied
+            self.assertEqual(stats.counters['strip_copy'],wanted)
+            for c in offspring:
+                c.mutate(2.0,repair=False)
+                c.repair()
+                self.assertEqual(sorted([i.id for i in c.strip.get_items()]),
+                                 sorted([i.id for i in c.items]))
+                score = c.score
+                c.evaluate()
+                self.assertEqual(c.score,score)
+            self.assertEqual((repr(a.strip),repr(b.strip)),before)
+        self.assertEqual(a.mutate(0.,repair=False),False)
+
+    def test_fused_repair(self):
+        """fix_layout gives the layout of the separate passes"""
+        random.seed(8)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(5)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        population = [StripChromosome() for i in range(4)]
+        for k in range(20):
+            a,b = random.sample(population,2)
+            sa = a.strip.clone()
+            sb = b.strip.clone()
+            x = random.choice(sa.get_strips())
+            y = random.choice(sb.get_strips())
+            i = random.randint(0,len(x))
+            j = random.randint(0,len(y))
+            x[i:],y[j:] = y[j:],x[i:]
+            random.choice(sa.get_items()).rotate()
+            fused = sa.clone()
+            state = random.getstate()
+            fused.fix_layout(StripChromosome.items,1e6,800)
+            random.setstate(state)
+            separate_fix_layout(sa,StripChromosome.items,1e6,800)
+            self.assertEqual(repr(fused),repr(sa))
+            self.assertEqual([e.id for e in fused.get_items()],
+                             [e.id for e in sa.get_items()])
+
+    def test_score_cache(self):
+        """a change drops the cached scores on its path only"""
+        random.seed(6)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(4)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        c = StripChromosome()
+        d = StripChromosome()
+        for k in range(10):
+            c,d = c.crossover(d)
+            c.mutate(2.0)
+            self.assertEqual(c.strip.fill_score(),
+                             uncached_fill_score(c.strip))
+            leaf = [s for s in c.strip.get_strips()
+                    if isinstance(s[0],Item)][0]
+            path = {}
+            node = leaf
+            while node is not None:
+                path[id(node)] = True
+                node = node.parent
+            leaf[0].rotate()
+            for s in c.strip.get_strips():
+                self.assertEqual(s.fill_cache is None,id(s) in path)
+            c.strip.update_dimensions(c.W,c.H)
+            self.assertEqual(c.strip.fill_score(),
+                             uncached_fill_score(c.strip))
+            self.assertEqual(c.strip.covered_area(),
+                             sum([i.area() for i in c.strip.get_items()]))
+
+    def test_find_best_place(self):
+        """the closed form picks the strip probing would pick"""
+        random.seed(4)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(4)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        strip = StripChromosome().strip
+        for t in types:
+            item = Item(t)
+            best = None
+            for candidate in strip.get_strips():
+                av_width,av_height = candidate.get_available_space()
+                if item.h<=av_height and item.w<=av_width or \
+                   item.w<=av_height and item.h<=av_width:
+                    closed = float(candidate.available_area())/ \
+                        (candidate.covered_area()+item.area())-1+ \
+                        candidate.element_scores()
+                    candidate.append(item)
+                    score = candidate.fill_score()
+                    candidate.pop()
+                    self.assertAlmostEqual(closed,score)
+                    if best is None or score<best[0]:
+                        best = (score,candidate)
+            found,rotated = strip.find_best_place(item)
+            self.assert_(found is best[1])
+
+    def test_fit_index(self):
+        """the index gives the placements of the full scan"""
+        random.seed(5)
+        types = [ItemType(w,h) for w,h in
+                 [(400,300),(300,200),(200,100),(500,250),(150,150)]]
+        StripChromosome.items = [Item(t) for t in types for k in range(3)]
+        StripChromosome.H = 800
+        StripChromosome.W = 1e6
+        StripChromosome.item_min_dim = 100
+        strip = StripChromosome().strip
+        index = FitIndex(strip.get_strips())
+        for k in range(10):
+            item = Item(random.choice(types))
+            wide = [id(s) for s in strip.get_strips()
+                    if s.get_available_space()[0]>=min(item.w,item.h)]
+            self.assertEqual(sorted(map(id,index.candidates(item))),
+                             sorted(wide))
+            expected = strip.find_best_place(item)
+            found = strip.find_best_place(item,index)
+            self.assert_(found[0] is expected[0])
+            self.assertEqual(found[1],expected[1])
+            if found[1]:
+                item.rotate()
+            touched = []
+            found[0].place([item],item,touched)
+            index.update(touched)
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestSequenceFunctions)
     unittest.TextTestRunner(verbosity=2).run(suite)